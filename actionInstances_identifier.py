@@ -3,24 +3,27 @@
 # STEP 3-1 - (OPTIONAL) IDENTIFY EXECUTION INSTANCE (FLOW OF ACTIONS)
 # It will make easier to identify gateways, loops, and sequence flows latter.
 import json
-from llm_completion import get_completion
+from typing import List
+from pydantic import BaseModel, Field
+from structured_output import StepOutput, structured_completion, astructured_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description", "ModelName", "Context", "Scope", "Objectives", "Participants", "StartEvent", "EndEvent", "ActivitiesEvents"]
 SYSTEM_MESSAGE_TEMPLATE = """"
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
 Explanation: In a business process, the flow of actions refers to the sequence in which activities and events (collectively called nodes) are executed. Identifying the flow involves understanding how one activity leads to another and how events trigger transitions between activities. This can include various types of flows such as sequential flows, conditional flows, and parallel flows.
 
-TASK: Given the process description and the list of Activities/Events (also called "Nodes") identified from this description within the delimiters {delimiter}, output a Python list of JSON objects. Ensure the output is strictly in JSON format without any additional text. Please identify the flow of actions (Activities/Events) by performing the following steps:
+TASK: Given the process description and the list of Activities/Events (also called "Nodes") identified from this description within the delimiters {delimiter}, output a Python list of JSON objects. Please identify the flow of actions (Activities/Events) by performing the following steps:
 
 Instructions:
 - Read Thoroughly: Carefully read the textual description of the business process to grasp the overall objective, scope, and details.
 - Identify Nodes: Using the list of provided "Activities/Events," identify the sequence of actions and their flow in the process.
 - Determine Flow: Establish the flow between identified nodes, ensuring each transition is clear and follows the logical sequence of the business process.
 - Construct JSON Objects: For each flow, create a JSON object that includes the list of nodes in the flow, in the correct sequence.
-- Output Format: Output a Python list of JSON objects detailing the flows identified in the previous steps. Ensure the output is strictly in JSON format without any additional text.
-- DO NOT output additional text except the JSON format. Do not output ```json or ```. Do not output comment "//"
+- Output Format: Output a Python list of JSON objects detailing the flows identified in the previous steps.
 
 Examples:
 
@@ -549,6 +552,16 @@ Output:
 # - Generally, if a process has a split gateway (e.g., XOR-split, OR-split, or AND-split), it will be followed by a corresponding join gateway (e.g., XOR-join, OR-join, or AND-join) to converge the paths. However, this is not always the case, as some processes may diverge without needing an explicit convergence.
 # - Ensure the output is strictly in JSON format without any additional text.
 
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class ActionFlow(BaseModel):
+    from_node: str = Field(alias="from")
+    to_node: str = Field(alias="to")
+
+class ActionFlowsOutput(StepOutput):
+    ActionFlows: List[ActionFlow]
+
+OUTPUT_SCHEMA = ActionFlowsOutput
+
 def construct_user_message(text):
     """
     Constructs the user message by wrapping the text with delimiters.
@@ -577,26 +590,45 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
-    Identifies gateways in a business process description.
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified gateways and related metadata.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies gateways in a business process description.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified gateways and related metadata.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
@@ -1,15 +1,19 @@
 
 #%%
 # STEP 3 - ACTIONS (EVENTS/ACTIVITIES) IDENTIFICATION
-from llm_completion import get_completion
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from structured_output import StepOutput, structured_completion, astructured_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description", "ModelName", "Context", "Scope", "Objectives", "Participants"]
 SYSTEM_MESSAGE_TEMPLATE = """
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
 Task:
-Analyze the following textual description of a business process within the delimiters {####} and identify distinct activities. Ensure that each activity is unique and avoid listing any duplicate activities or events that may occur due to loops within the process. Provide a clear and concise list of these activities, explicitly handling any repetitive actions due to loops without duplicating them. Output a Python list of JSON objects with keys: StartEvent, EndEvent, Activities, and Participants. Ensure the output is strictly in JSON format without any additional text.
+Analyze the following textual description of a business process within the delimiters {####} and identify distinct activities. Ensure that each activity is unique and avoid listing any duplicate activities or events that may occur due to loops within the process. Provide a clear and concise list of these activities, explicitly handling any repetitive actions due to loops without duplicating them. Output a Python list of JSON objects with keys: StartEvent, EndEvent, ActivitiesEvents (each with its participant).
 
 Instructions:
 - Read Thoroughly: Carefully read the textual description of the business process to grasp the overall objective, scope, and details.
@@ -22,7 +26,6 @@ Instructions:
 - Identify Activities/Events: Identify specific actions or tasks described in the text and event usually in verb forms, assigning a variable to each (e.g., A_RecieveOrder, A_CheckCredit, E_RecieveEmail) (note that A for activities or tasks, E for Events). List of distinct activities without any redundancy. If some steps or actions include sub-steps or sub-actions, break them down and place them at the same level as other main steps/actions
     - Textual Clues: These are the core actions that drive the process forward. Look for verbs or action phrases like "register", "investigate", "prepare", "review", "approve", "admit", "examine", "process", "schedule", or "conduct".
 - Identify Participants: Identify the single participant involved in each activity or event and include them in the output.
-- DO NOT output additional text except the JSON format. Do not output ```json or ```. Do not output comment "//"
 
 Examples:
 
@@ -386,6 +389,28 @@ Output:
 """
 
 
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class ActivityEvent(BaseModel):
+    id: str = Field(description="A_<Name> for activities, E_<Name> for events")
+    description: str = Field(description="The text the activity or event was derived from")
+    participant: Optional[str]
+
+class ActivitiesOutput(StepOutput):
+    StartEvent: str = Field(description="Start_<Name>")
+    EndEvent: str = Field(description="End_<Name>")
+    ActivitiesEvents: List[ActivityEvent]
+
+    def to_output(self):
+        activities_events = []
+        for activity in self.ActivitiesEvents:
+            entry = {activity.id: activity.description}
+            if activity.participant:
+                entry["Participant"] = activity.participant
+            activities_events.append(entry)
+        return {"StartEvent": self.StartEvent, "EndEvent": self.EndEvent, "ActivitiesEvents": activities_events}
+
+OUTPUT_SCHEMA = ActivitiesOutput
+
 def construct_user_message(text):
     """
     Constructs the user message by wrapping the text with delimiters.
@@ -414,26 +439,45 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
-    Identifies activities or events in a business process description.
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified  activities or events.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies activities or events in a business process description.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified  activities or events.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
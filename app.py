@@ -1,11 +1,125 @@
 # FLASK WEB UI
 import json
-from flask import Flask, render_template, request, url_for, jsonify
-from main_pipeline import pipeline as bpm_genenration # Import the pipeline function
+import threading
+import uuid
+from collections import OrderedDict
+from flask import Flask, Response, render_template, request, url_for, jsonify, session, send_from_directory, stream_with_context
+from main_pipeline import IncrementalPipeline, print_step_result # Pipeline remembering the last run per editing session
 from bp_logic_visualizer import visualize_bpmn, generate_dot_from_sequence # Import graphviz visualizer function
+from llm_completion import warmup, shutdown as close_llm_clients
+from job_queue import JobQueue, QueueFull, FINAL_STATUSES
+from artifact_store import ArtifactStore, make_artifact_key
+import atexit
 import os
 
 app = Flask(__name__)
+app.secret_key = os.environ.get("FLASK_SECRET_KEY") or os.urandom(24)
+atexit.register(close_llm_clients) # Release pooled LLM connections on shutdown
+
+# Editing sessions: the last run of each browser session, so an edited description only re-runs the changed steps
+MAX_EDITING_SESSIONS = 100
+editing_sessions = OrderedDict()
+editing_sessions_lock = threading.Lock()
+# Time budget of one /process job in seconds, counted from its start: its LLM calls time out with the time left
+# and no further steps start once it is used up
+PROCESS_TIMEOUT = float(os.environ.get("PROCESS_TIMEOUT", "120"))
+# Background workers running /process jobs and the number of jobs that may wait for them. Request threads only
+# enqueue a job, so a few web workers can accept many concurrent users.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "64"))
+# Seconds a client is asked to wait before retrying when the queue is full
+QUEUE_FULL_RETRY_AFTER = 5
+# Latest /process job of each editing session
+session_jobs = {}
+# Seconds between keep-alive comments on an idle event stream, so proxies do not close it
+EVENT_STREAM_KEEPALIVE = 15
+
+# Warm up the LLM backends in the background as soon as the app is loaded, so every WSGI worker process opens its
+# connections and credentials before its first /process request without delaying start-up. Set LLM_WARMUP=0 to
+# disable it, e.g. for servers that load the app before forking their workers (gunicorn --preload).
+LLM_WARMUP = os.environ.get("LLM_WARMUP", "1") != "0"
+if LLM_WARMUP:
+    threading.Thread(target=warmup, name="llm-warmup", daemon=True).start()
+
+jobs = JobQueue(JOB_WORKERS, JOB_QUEUE_DEPTH)
+atexit.register(jobs.shutdown) # Registered last, so it runs before the LLM connections are closed
+
+# Rendered models, stored under the hash of their sequence flows: identical models are rendered once and every
+# artifact URL names immutable content
+ARTIFACT_DIRECTORY = os.environ.get("ARTIFACT_DIRECTORY", "./cache/artifacts")
+MAX_ARTIFACTS = int(os.environ.get("MAX_ARTIFACTS", "1000"))
+MAX_ARTIFACT_BYTES = int(os.environ.get("MAX_ARTIFACT_BYTES", str(256 * 1024 * 1024)))
+ARTIFACT_MAX_AGE = 365 * 24 * 3600 # seconds browsers may cache an artifact
+artifacts = ArtifactStore(ARTIFACT_DIRECTORY, MAX_ARTIFACTS, MAX_ARTIFACT_BYTES)
+
+def get_editing_pipeline():
+    if "editor_id" not in session:
+        session["editor_id"] = uuid.uuid4().hex
+    with editing_sessions_lock:
+        editing_pipeline = editing_sessions.pop(session["editor_id"], None) or IncrementalPipeline()
+        editing_sessions[session["editor_id"]] = editing_pipeline
+        while len(editing_sessions) > MAX_EDITING_SESSIONS:
+            editor_id, _ = editing_sessions.popitem(last=False) # Forget the least recently used session
+            session_jobs.pop(editor_id, None)
+    return editing_pipeline
+
+def step_event(step, record):
+    """
+    Returns:
+        dict: The data of a finished step's event: its output, timing and token usage.
+    """
+    return {
+        'step': step.name,
+        'title': step.title,
+        'output': record['output'],
+        'duration': record['duration'],
+        'prompt_tokens': record['prompt_tokens'],
+        'completion_tokens': record['completion_tokens'],
+        'restored': record['restored'],
+        'skipped': record['skipped'],
+        'models': [f"{attempt['api']}:{attempt['model']}" for attempt in record['attempts']],
+    }
+
+def run_process_job(editing_pipeline, description, cancel_token=None, publish=None):
+    """
+    Background job of /process: runs the pipeline over the description and renders its sequence flows, unless the
+    artifact store already holds the same model.
+
+    Parameters:
+        editing_pipeline (IncrementalPipeline): The pipeline of the editing session.
+        description (str): The textual description of the business process.
+        cancel_token (CancellationToken): The job's deadline and cancellation flag.
+        publish (callable): Optional publish(event, data) receiving a "step" event as each step finishes.
+
+    Returns:
+        dict: The file name of the rendered model in the artifact store.
+    """
+    def on_step_done(step, record):
+        print_step_result(step, record)
+        if publish is not None:
+            publish('step', step_event(step, record))
+
+    result, sequenceFlows = editing_pipeline.run(description, on_step_done=on_step_done, cancel_token=cancel_token)
+
+    # Save bpm SVG file to the artifact store
+    data = json.loads(sequenceFlows)
+    sequence_flows = data[0]["SequenceFlows"]
+
+    def render(directory, name):
+        bp_dot = generate_dot_from_sequence(sequence_flows)
+        visualize_bpmn(bp_dot, file_name=name, directory=directory, file_format='svg', view=False)
+
+    file_name = artifacts.get_or_render(make_artifact_key(sequence_flows, 'svg'), 'svg', render)
+    print(" ===> DONE \n")
+    return {'artifact': file_name}
+
+def job_response(job):
+    response = job.to_dict()
+    response['status_url'] = url_for('job_status', job_id=job.id)
+    response['events_url'] = url_for('job_events', job_id=job.id)
+    if job.status == 'done':
+        response['svg_url'] = url_for('artifact', file_name=job.result['artifact'])
+    return response
 
 @app.route('/', methods=['GET'])
 def index():
@@ -14,25 +128,78 @@ def index():
 @app.route('/process', methods=['POST'])
 def process_text():
     description = request.form['description']
-    result, sequenceFlows = bpm_genenration(description)
-    
-    # Save bpm SVG file to ./static
+    editing_pipeline = get_editing_pipeline()
     try:
-        data = json.loads(sequenceFlows)
-        sequence_flows = data[0]["SequenceFlows"]
-        bp_dot = generate_dot_from_sequence(sequence_flows)
-        visualize_bpmn(bp_dot, file_name='web_view_bpm_model', directory='./static', file_format='svg')
-        print(" ===> DONE \n")
-    except Exception as e:
-        print(" ===> Error in visualization")
-        print(f"Error: {e}")
-    
-    # Assuming your visualization function saves an SVG in a predictable location
-    svg_url = url_for('static', filename='web_view_bpm_model.svg')
-    return jsonify({'svg_url': svg_url})
+        job = jobs.submit(run_process_job, editing_pipeline, description, timeout=PROCESS_TIMEOUT)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(QUEUE_FULL_RETRY_AFTER)}
+
+    # A job still queued or running for the same session is cancelled: its result would be replaced by this one
+    with editing_sessions_lock:
+        previous_job_id = session_jobs.get(session["editor_id"])
+        session_jobs[session["editor_id"]] = job.id
+    if previous_job_id is not None:
+        jobs.cancel(previous_job_id, "superseded by a newer request")
+    return jsonify(job_response(job)), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job: "running", one "step" event per finished pipeline step and finally "done"
+    (with the svg_url), "failed" or "cancelled". A reconnecting client resumes after its Last-Event-ID.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    try:
+        index = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        index = 0
+
+    def generate(index):
+        while True:
+            events = job.events_since(index, timeout=EVENT_STREAM_KEEPALIVE)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event, data in events:
+                if event in FINAL_STATUSES:
+                    data = job_response(job)
+                yield f'id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+                index += 1
+                if event in FINAL_STATUSES:
+                    return
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # Not buffered by proxies such as nginx
+    return Response(stream_with_context(generate(index)), mimetype='text/event-stream', headers=headers)
+
+@app.route('/artifacts/<file_name>', methods=['GET'])
+def artifact(file_name):
+    # Artifact names are content hashes, so a name never changes its content and browsers never need to revalidate
+    if artifacts.get(file_name) is None:
+        return jsonify({'error': 'Unknown artifact'}), 404
+    response = send_from_directory(os.path.abspath(artifacts.directory), file_name, max_age=ARTIFACT_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={ARTIFACT_MAX_AGE}, immutable'
+    return response
+
+@app.route('/cancel', methods=['POST'])
+def cancel_process():
+    # Sent by the page when it is left or reloaded, so an abandoned job stops spending LLM calls
+    with editing_sessions_lock:
+        job_id = session_jobs.pop(session.get("editor_id"), None)
+    if job_id is not None:
+        jobs.cancel(job_id, "abandoned by the browser")
+    return '', 204
 
 if __name__ == '__main__':
     app.run(debug=True)
 
 # SAMPLE DESCRIPTION
-# In the treasury minister’s office, once a ministerial inquiry has been received, it is first registered into the system. Then the inquiry is investigated so that a ministerial response can be prepared. The finalization of a response includes the preparation of the response itself by the cabinet officer and the review of the response by the principal registrar. If the registrar does not approve the response, the latter needs to be prepared again by the cabinet officer for review. The process finishes only once the response has been approved. 
\ No newline at end of file
+# In the treasury minister’s office, once a ministerial inquiry has been received, it is first registered into the system. Then the inquiry is investigated so that a ministerial response can be prepared. The finalization of a response includes the preparation of the response itself by the cabinet officer and the review of the response by the principal registrar. If the registrar does not approve the response, the latter needs to be prepared again by the cabinet officer for review. The process finishes only once the response has been approved.
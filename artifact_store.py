@@ -0,0 +1,169 @@
+#%%
+# CONTENT-ADDRESSED ARTIFACT STORE FOR RENDERED MODELS
+# Rendered diagrams are stored under the hash of the sequence flows they show: identical models are rendered once,
+# concurrent requests never overwrite each other's files and every file name stands for immutable content, so it
+# can be cached by browsers for good. The store is bounded by file count and total size and evicts the least
+# recently used artifacts.
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+DEFAULT_ARTIFACT_DIRECTORY = "./cache/artifacts"
+DEFAULT_MAX_ARTIFACTS = 1000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # total size of stored artifacts before LRU eviction
+TEMP_PREFIX = ".render-"
+
+def make_artifact_key(sequence_flows, file_format="svg"):
+    """
+    Derives the content-addressed key of a rendered model.
+
+    Parameters:
+        sequence_flows (list): The sequence flows the diagram is rendered from.
+        file_format (str): The file format of the rendering, e.g. "svg".
+
+    Returns:
+        str: The SHA-256 hex digest identifying the artifact.
+    """
+    payload = json.dumps(
+        {"sequence_flows": sequence_flows, "file_format": file_format},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ArtifactStore:
+    """
+    Directory of rendered artifacts named <key>.<file_format> with size- and count-based LRU eviction.
+    Safe to share between threads; artifacts of earlier processes are picked up on start.
+    """
+
+    def __init__(self, directory=DEFAULT_ARTIFACT_DIRECTORY, max_artifacts=DEFAULT_MAX_ARTIFACTS, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_artifacts = max_artifacts
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index = OrderedDict() # file name -> size, least recently used first
+        self._bytes = 0
+        self._rendering = {} # file name -> lock held while it is rendered
+        self._lock = threading.Lock()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        # Earlier artifacts in the order of their last use (the modification time is refreshed on every hit);
+        # leftovers of interrupted renderings are removed
+        entries = []
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if file_name.startswith(TEMP_PREFIX):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, file_name, stat.st_size))
+        for _, file_name, size in sorted(entries):
+            self._index[file_name] = size
+            self._bytes += size
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def get(self, file_name):
+        """
+        Looks up a stored artifact and marks it as recently used.
+
+        Parameters:
+            file_name (str): The artifact's file name, <key>.<file_format>.
+
+        Returns:
+            str: The file name, or None when the artifact is not stored (anymore).
+        """
+        with self._lock:
+            if file_name not in self._index:
+                return None
+            self._index.move_to_end(file_name)
+        try:
+            os.utime(self.path(file_name))
+        except OSError:
+            pass
+        return file_name
+
+    def get_or_render(self, key, file_format, render):
+        """
+        Returns the artifact of a key, rendering it only when it is not stored yet. Concurrent calls for the same
+        key wait for one rendering.
+
+        Parameters:
+            key (str): The key returned by make_artifact_key.
+            file_format (str): The file format of the rendering, e.g. "svg".
+            render (callable): render(directory, name) writes the artifact to <directory>/<name>.<file_format>;
+                other files it writes there are discarded.
+
+        Returns:
+            str: The artifact's file name, <key>.<file_format>.
+
+        Raises:
+            RuntimeError: If render wrote no artifact.
+        """
+        file_name = f"{key}.{file_format}"
+        if self.get(file_name) is not None:
+            with self._lock:
+                self.hits += 1
+            return file_name
+        with self._lock:
+            rendering = self._rendering.setdefault(file_name, threading.Lock())
+        with rendering:
+            if self.get(file_name) is not None:
+                with self._lock:
+                    self.hits += 1
+                return file_name
+            with self._lock:
+                self.misses += 1
+            try:
+                self._render(file_name, key, file_format, render)
+            finally:
+                with self._lock:
+                    self._rendering.pop(file_name, None)
+        return file_name
+
+    def _render(self, file_name, key, file_format, render):
+        # Renders into a private directory and moves the artifact into place, so it is never seen half-written
+        temp_directory = self.path(TEMP_PREFIX + uuid.uuid4().hex)
+        os.makedirs(temp_directory)
+        try:
+            render(temp_directory, key)
+            rendered_path = os.path.join(temp_directory, f"{key}.{file_format}")
+            if not os.path.exists(rendered_path):
+                raise RuntimeError(f"Error: rendering produced no {file_name}.")
+            size = os.path.getsize(rendered_path)
+            os.replace(rendered_path, self.path(file_name))
+        finally:
+            shutil.rmtree(temp_directory, ignore_errors=True)
+        with self._lock:
+            self._index[file_name] = size
+            self._bytes += size
+            evicted = []
+            while len(self._index) > 1 and (len(self._index) > self.max_artifacts or self._bytes > self.max_bytes):
+                old_file_name, old_size = self._index.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(old_file_name)
+        for old_file_name in evicted:
+            try:
+                os.remove(self.path(old_file_name))
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters and the current number of artifacts and bytes stored.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "artifacts": len(self._index), "bytes": self._bytes}
@@ -0,0 +1,312 @@
+#%%
+# OFFLINE BULK MODE (OPENAI BATCH API FORMAT)
+# Runs the pipeline stage by stage over many descriptions: the requests of one step for every description are
+# written to a JSONL batch file, executed as one batch, and the results feed the next step's batch. Steps with a
+# model cascade run one batch per tier: only the documents whose output failed the step's check go to the next tier.
+import json
+import os
+import time
+from main_pipeline import PIPELINE_STEPS, update_total_tokens
+from step_graph import step_ancestors, upstream_fields, build_step_input, apply_record, parse_json_result, skip_step, restore_step, save_step, check_step_output
+from model_cascade import step_tiers, make_attempt
+from llm_completion import supports_json_schema
+from structured_output import response_format_for, parse_structured_result, json_only_messages
+from json_recovery import recover_json_text
+from process_model import ProcessModel
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+POLL_INTERVAL = 30  # seconds between batch status checks
+FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def build_batch_line(custom_id, messages, model, temperature, max_tokens=1000, response_format=None):
+    """
+    Builds one request line of an OpenAI Batch input file.
+
+    Returns:
+        dict: The batch request with custom_id, method, url and Chat Completions body.
+    """
+    body = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if response_format is not None:
+        body["response_format"] = response_format
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": body,
+    }
+
+def write_jsonl(lines, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w", encoding="utf-8") as file:
+        for line in lines:
+            file.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def read_batch_output(path):
+    """
+    Parses an OpenAI Batch output file.
+
+    Parameters:
+        path (str): The path of the output JSONL file.
+
+    Returns:
+        dict: custom_id -> (result, prompt_tokens, completion_tokens, error). error is None on success.
+    """
+    results = {}
+    for line in read_jsonl(path):
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        error = line.get("error")
+        if error is None and response.get("status_code") != 200:
+            error = body.get("error") or f"status code {response.get('status_code')}"
+        if error is not None:
+            results[line["custom_id"]] = ("", 0, 0, error)
+            continue
+        usage = body.get("usage") or {}
+        results[line["custom_id"]] = (
+            body["choices"][0]["message"]["content"],
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            None,
+        )
+    return results
+
+class OpenAIBatchRunner:
+    """
+    Executes a batch input file with the OpenAI Batch API and downloads the output file.
+    """
+    api = "openai"
+
+    def __init__(self, poll_interval=POLL_INTERVAL, completion_window=COMPLETION_WINDOW):
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    def run(self, input_path, output_path):
+        from config import OPENAI_API_KEY
+        from llm_clients import get_openai_client
+
+        client = get_openai_client("openai", OPENAI_API_KEY)
+        with open(input_path, "rb") as file:
+            input_file = client.files.create(file=file, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+        )
+        print(f"Submitted batch {batch.id} ({input_path})")
+        while batch.status not in FINAL_BATCH_STATUSES:
+            time.sleep(self.poll_interval)
+            batch = client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id} finished with status {batch.status}")
+
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip())
+        write_jsonl(lines, output_path)
+
+class LocalBatchRunner:
+    """
+    Local stand-in for the Batch API: consumes the JSONL input with get_completion and writes an output
+    file in the Batch output format. Useful for testing and for backends without a batch endpoint.
+    """
+
+    def __init__(self, api="openai", model=None):
+        self.api = api
+        self.model = model  # overrides the model of every request when set, e.g. a local Ollama model
+
+    def run(self, input_path, output_path):
+        from llm_completion import get_completion
+
+        lines = []
+        for request in read_jsonl(input_path):
+            body = request["body"]
+            model = self.model or body["model"]
+            try:
+                result, prompt_tokens, completion_tokens = get_completion(
+                    body["messages"], self.api, model, body.get("temperature", 0.7), body.get("max_tokens", 1000),
+                    response_format=body.get("response_format"),
+                )
+            except Exception as e:
+                lines.append({"id": request["custom_id"], "custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}})
+                continue
+            lines.append({
+                "id": request["custom_id"],
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "object": "chat.completion",
+                        "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": result}, "finish_reason": "stop"}],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        },
+                    },
+                },
+                "error": None,
+            })
+        write_jsonl(lines, output_path)
+
+def batch_messages(step, step_input, output_schema):
+    messages = step.module.build_messages(step_input)
+    if step.output_format == "json" and output_schema is None:
+        return json_only_messages(messages)
+    return messages
+
+def run_step_batches(step, index, step_inputs, models, runner, work_dir):
+    """
+    Runs one step for the given documents, one batch per cascade tier (see model_cascade.step_tiers).
+    The batch runner decides the backend; the tiers only choose the model of each batch. The step's output schema
+    is requested when the runner's backend supports structured outputs; otherwise JSON steps are asked for JSON only.
+
+    Returns:
+        dict: Document id -> (result, error, attempts) of the tier whose result was accepted.
+    """
+    tiers = step_tiers(step)
+    output_schema = step.module.OUTPUT_SCHEMA if supports_json_schema(runner.api) else None
+    response_format = response_format_for(output_schema) if output_schema is not None else None
+    finished = {}
+    attempts = {doc_id: [] for doc_id in step_inputs}
+    pending = list(step_inputs)
+    for tier, (api, model) in enumerate(tiers):
+        if not pending:
+            break
+        suffix = "" if tier == 0 else f"_tier{tier + 1}"
+        input_path = os.path.join(work_dir, f"{index}_{step.name}{suffix}_input.jsonl")
+        output_path = os.path.join(work_dir, f"{index}_{step.name}{suffix}_output.jsonl")
+        lines = [build_batch_line(doc_id, batch_messages(step, step_inputs[doc_id], output_schema), model, step.temperature, response_format=response_format) for doc_id in pending]
+        write_jsonl(lines, input_path)
+        runner.run(input_path, output_path)
+        results = read_batch_output(output_path)
+
+        escalated = []
+        for doc_id in pending:
+            result, prompt_tokens, completion_tokens, error = results.get(doc_id, ("", 0, 0, "missing from batch output"))
+            last_tier = tier == len(tiers) - 1
+            problems = []
+            if error is None and step.output_format == "json":
+                try:
+                    # Batches cannot be continued, so a truncated result fails like any unrecoverable one
+                    result = recover_json_text(result)
+                    if output_schema is not None:
+                        result = parse_structured_result(result, output_schema)
+                except ValueError as e:
+                    # As in the live cascade, an unusable response escalates unless it is the last tier
+                    if last_tier:
+                        error = str(e)
+                    else:
+                        problems = [str(e)]
+            if error is None and not problems and not last_tier:
+                problems = check_step_output(step, models[doc_id], result)
+            attempts[doc_id].append(make_attempt(api, model, prompt_tokens, completion_tokens, problems))
+            if problems:
+                escalated.append(doc_id)
+            else:
+                finished[doc_id] = (result, error, attempts[doc_id])
+        if escalated:
+            print(f"Step {index}: {step.name} - escalating {len(escalated)} of {len(pending)} requests from {model}")
+        pending = escalated
+    return finished
+
+def bulk_pipeline(descriptions, runner=None, work_dir="./output/batch", steps=PIPELINE_STEPS):
+    """
+    Runs the pipeline over many descriptions, one batch per step in declaration order.
+
+    Parameters:
+        descriptions (dict): Document id -> textual description of the business process.
+        runner: An object with run(input_path, output_path), e.g. OpenAIBatchRunner or LocalBatchRunner.
+        work_dir (str): The directory for the per-step batch input and output files.
+        steps (list): The pipeline steps, by default main_pipeline.PIPELINE_STEPS.
+
+    Returns:
+        tuple: Document id -> (combined JSON result, sequence flow result) for every completed document,
+        document id -> error for every failed document, and the total prompt and completion tokens.
+    """
+    runner = runner or OpenAIBatchRunner()
+    fields = upstream_fields(steps, step_ancestors(steps))
+    models = {doc_id: ProcessModel(description) for doc_id, description in descriptions.items()}
+    records = {doc_id: {} for doc_id in descriptions}
+    errors = {}
+    total_prompt_tokens = 0
+    total_completion_tokens = 0
+
+    for index, step in enumerate(steps, start=1):
+        if not records:
+            break
+        step_inputs = {}
+        for doc_id, doc_records in records.items():
+            step_input = build_step_input(step, models[doc_id], fields)
+            # Documents where the step is gated or checkpointed by an earlier (interrupted) run are not sent
+            restored = skip_step(step, models[doc_id], step_input) or restore_step(step, step_input)
+            if restored is not None:
+                doc_records[step.name] = restored
+                apply_record(models[doc_id], step, restored)
+                continue
+            step_inputs[doc_id] = step_input
+        print(f"Step {index}: {step.name} - {len(step_inputs)} requests, {len(records) - len(step_inputs)} skipped or restored")
+        if not step_inputs:
+            continue
+        results = run_step_batches(step, index, step_inputs, models, runner, work_dir)
+
+        for doc_id in step_inputs:
+            result, error, attempts = results[doc_id]
+            prompt_tokens = sum(attempt["prompt_tokens"] for attempt in attempts)
+            completion_tokens = sum(attempt["completion_tokens"] for attempt in attempts)
+            try:
+                if error is not None:
+                    raise ValueError(error)
+                output = result if step.output_format == "text" else parse_json_result(result)
+            except ValueError as e:
+                # A failed or invalid step would break the input of every later step for this document
+                errors[doc_id] = f"{step.name}: {e}"
+                del records[doc_id]
+                continue
+            records[doc_id][step.name] = {
+                "input": step_inputs[doc_id],
+                "result": result,
+                "output": output,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "restored": False,
+                "skipped": None,
+                "attempts": attempts,
+            }
+            apply_record(models[doc_id], step, records[doc_id][step.name])
+            save_step(step, records[doc_id][step.name])
+            if step.name != "preprocess": # As in pipeline(), preprocessing tokens are not counted
+                total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
+
+    last_step = steps[-1].name
+    outputs = {
+        doc_id: (models[doc_id].to_json(), doc_records[last_step]["result"])
+        for doc_id, doc_records in records.items()
+    }
+    return outputs, errors, total_prompt_tokens, total_completion_tokens
+
+# Example usage
+if __name__ == "__main__":
+    descriptions = {
+        "treasury": "In the treasury minister’s office, once a ministerial inquiry has been received, it is first registered into the system. Then the inquiry is investigated so that a ministerial response can be prepared. The finalization of a response includes the preparation of the response itself by the cabinet officer and the review of the response by the principal registrar. If the registrar does not approve the response, the latter needs to be prepared again by the cabinet officer for review. The process finishes only once the response has been approved.",
+        "warehouses": "A company has two warehouses that store different products: Amsterdam and Hamburg. When an order is received, it is distributed across these warehouses: if some of the relevant products are maintained in Amsterdam, a sub-order is sent there; likewise, if some relevant products are maintained in Hamburg, a sub-order is sent there. Afterwards, the order is registered and the process completes.",
+    }
+    outputs, errors, prompt_tokens, completion_tokens = bulk_pipeline(descriptions, runner=LocalBatchRunner())
+    for doc_id, (result, sequence_flows) in outputs.items():
+        print(doc_id, sequence_flows)
+    print("Errors:", errors)
+    print(f"Total tokens: {prompt_tokens} prompt, {completion_tokens} completion")
+
+# %%
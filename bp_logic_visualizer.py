@@ -72,7 +72,7 @@ def generate_dot_from_sequence(sequence_flows):
 
     return "\n".join(dot_lines)
 
-def visualize_bpmn(dot_string, file_name='bpmn_model', directory='.', file_format='svg'):
+def visualize_bpmn(dot_string, file_name='bpmn_model', directory='.', file_format='svg', view=True):
     """
     Visualizes a BPMN model using Graphviz.
     
@@ -81,6 +81,7 @@ def visualize_bpmn(dot_string, file_name='bpmn_model', directory='.', file_forma
         file_name (str): The name of the output file (without extension).
         directory (str): The directory where the output file will be saved.
         file_format (str): The format of the output file (e.g., 'svg', 'png', 'pdf').
+        view (bool): Whether to open the rendered file in the default viewer.
     """
     try:
         # Ensure the directory exists
@@ -94,7 +95,7 @@ def visualize_bpmn(dot_string, file_name='bpmn_model', directory='.', file_forma
         graph = graphviz.Source(dot_string)
         
         # Render and view the graph
-        graph.render(file_path, format=file_format, view=True)
+        graph.render(file_path, format=file_format, view=view)
         
         print(f"Graphviz visualization generated successfully at {file_path}.{file_format}.")
     except Exception as e:
@@ -0,0 +1,151 @@
+#%%
+# DEADLINES AND COOPERATIVE CANCELLATION OF PIPELINE RUNS
+# A CancellationToken carries the time budget of one run and can be cancelled from another thread, e.g. when the
+# browser that requested the run is gone. The step executor keeps the token of the running pipeline in a context
+# variable, so get_completion finds it without every step module passing it on: each LLM call gets the remaining
+# budget as its timeout, and rate limit waits and retries stop as soon as the token is cancelled or expired.
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+class PipelineCancelled(Exception):
+    """
+    Raised when a pipeline run was cancelled. Deliberately not a ValueError, so it neither escalates a model
+    cascade nor makes the fused extraction fall back to the staged pipeline.
+    """
+
+class DeadlineExceeded(PipelineCancelled):
+    """
+    Raised when a pipeline run used up its time budget.
+    """
+
+class CancellationToken:
+    """
+    Deadline and cancellation flag of one pipeline run. Thread-safe.
+
+    Parameters:
+        timeout (float): The time budget of the run in seconds, or None for a run without a deadline.
+    """
+
+    def __init__(self, timeout=None):
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason="cancelled"):
+        """
+        Cancels the run: no further steps or LLM calls are started.
+        """
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def remaining(self):
+        """
+        Returns:
+            float: The seconds left until the deadline, or None when the run has no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def error(self):
+        """
+        Returns:
+            PipelineCancelled: The error stopping the run, or None while it may go on.
+        """
+        if self._event.is_set():
+            return PipelineCancelled(f"Pipeline run cancelled: {self.reason}")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return DeadlineExceeded("Pipeline run exceeded its deadline.")
+        return None
+
+    def raise_if_cancelled(self):
+        error = self.error()
+        if error is not None:
+            raise error
+
+    def sleep(self, seconds):
+        """
+        Sleeps unless the run is cancelled in the meantime. A sleep that would outlast the deadline fails right away.
+        """
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded("Pipeline run exceeded its deadline.")
+        self._event.wait(seconds)
+        self.raise_if_cancelled()
+
+    async def asleep(self, seconds):
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded("Pipeline run exceeded its deadline.")
+        await asyncio.sleep(seconds)
+        self.raise_if_cancelled()
+
+_current_token = contextvars.ContextVar("cancellation_token", default=None)
+
+def current_token():
+    """
+    Returns:
+        CancellationToken: The token of the pipeline run in this context, or None.
+    """
+    return _current_token.get()
+
+@contextmanager
+def cancellation_scope(token):
+    """
+    Makes token the current token inside the with block. Threads started in it only see the token when they
+    run in a copy of the context (contextvars.copy_context().run); asyncio tasks copy it themselves.
+    """
+    reset_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset_token)
+
+def raise_if_cancelled():
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+def call_timeout():
+    """
+    Returns:
+        float: The timeout of the next LLM call (the time left of the run), or None to keep the client default.
+    """
+    token = _current_token.get()
+    return None if token is None else token.remaining()
+
+def sleep(seconds):
+    # time.sleep that ends early when the current run is cancelled
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+async def asleep(seconds):
+    token = _current_token.get()
+    if token is None:
+        await asyncio.sleep(seconds)
+    else:
+        await token.asleep(seconds)
+
+def cancellable_chunks(on_chunk):
+    """
+    Wraps a streaming callback so a cancelled or expired run stops reading the stream at the next delta.
+    """
+    token = _current_token.get()
+    if on_chunk is None or token is None:
+        return on_chunk
+
+    def checked_on_chunk(delta):
+        token.raise_if_cancelled()
+        on_chunk(delta)
+    return checked_on_chunk
@@ -2,15 +2,19 @@
 #%%
 # STEP 2 - CONTEXT UNDERSTANDING
 import json
-from llm_completion import get_completion
+from typing import List
+from pydantic import BaseModel, Field
+from structured_output import StepOutput, structured_completion, astructured_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description"]
 SYSTEM_MESSAGE_TEMPLATE = """
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
 Task:
-Understand the textual description, identify the context, and overall process goal of textual descriptions of BPMN process models within the delimiters {delimiter}. Output a Python list of JSON objects with keys: ModelName, Context, Scope, Objectives, Participants. Ensure the output is strictly in JSON format without any additional text.
+Understand the textual description, identify the context, and overall process goal of textual descriptions of BPMN process models within the delimiters {delimiter}. Output a Python list of JSON objects with keys: ModelName, Context, Scope, Objectives, Participants.
 
 Instructions:
 - Read Thoroughly: Carefully read the textual description of the business process to grasp the overall objective, scope, and details.
@@ -18,7 +22,6 @@ Instructions:
 - Clarify Scope: Determine the boundaries of the process (start and end points).
 - Set Objectives: Understand the purpose of the process and its desired outcomes.
 - Identify Participants and Roles: Identify different Participants and Roles involved in the process. These are typically represented as pools or lanes in BPMN. Textual Clues: Look for specific roles or departments mentioned, such as "cabinet officer", "principal registrar", "customer service", or "logistics team".
-- DO NOT output additional text except the JSON format. Do not output ```json or ``` or \n
 
 Examples:
 
@@ -149,6 +152,25 @@ Output:
 """
 
 
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class Participant(BaseModel):
+    name: str = Field(description="Participant or role, e.g. HR_Department")
+    responsibility: str
+
+class ContextOutput(StepOutput):
+    ModelName: str
+    Context: str
+    Scope: str
+    Objectives: str
+    Participants: List[Participant]
+
+    def to_output(self):
+        output = self.model_dump()
+        output["Participants"] = [{participant.name: participant.responsibility} for participant in self.Participants]
+        return output
+
+OUTPUT_SCHEMA = ContextOutput
+
 def construct_user_message(text):
     """
     Constructs the user message by wrapping the text with delimiters.
@@ -177,26 +199,45 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
-    Identifies context in a business process description.
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified context and related metadata.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies context in a business process description.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified context and related metadata.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
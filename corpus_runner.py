@@ -0,0 +1,207 @@
+#%%
+# CORPUS BATCH RUNNER
+# Runs the pipeline over a directory of .txt descriptions or a JSONL file with a bounded pool of workers and
+# writes the combined JSON, sequence flows and rendered SVG of every document to its own output directory.
+# Each document runs its steps one after another, so at most one step call per worker is in flight.
+#
+# Usage: python corpus_runner.py <descriptions dir or .jsonl> --output ./output/corpus --workers 8
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from main_pipeline import run_pipeline, records_cost, update_total_tokens, sequence_flow_result
+from step_checkpoints import DEFAULT_CHECKPOINT_PATH, enable_step_checkpoints
+from step_gating import disable_step_gating
+from model_cascade import disable_model_cascade, attempted_models, escalation_rates
+from cancellation import CancellationToken
+
+DEFAULT_WORKERS = 8
+DEFAULT_OUTPUT_DIR = "./output/corpus"
+
+def load_descriptions(source):
+    """
+    Loads the process descriptions of a corpus.
+
+    Parameters:
+        source (str): A directory of .txt files (document id = file name) or a JSONL file with one
+            {"id": ..., "description": ...} object per line ("text" is accepted instead of "description").
+
+    Returns:
+        dict: Document id -> textual description of the business process.
+    """
+    descriptions = {}
+    if os.path.isdir(source):
+        for file_name in sorted(os.listdir(source)):
+            if file_name.endswith(".txt"):
+                with open(os.path.join(source, file_name), encoding="utf-8") as file:
+                    descriptions[os.path.splitext(file_name)[0]] = file.read()
+        return descriptions
+
+    with open(source, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            document = json.loads(line)
+            doc_id = str(document.get("id", line_number))
+            descriptions[doc_id] = document.get("description", document.get("text", ""))
+    return descriptions
+
+def document_dir(output_dir, doc_id):
+    # Document ids become directory names, so anything outside a safe character set is replaced
+    return os.path.join(output_dir, re.sub(r"[^A-Za-z0-9._-]", "_", doc_id))
+
+def write_document_outputs(directory, result, sequence_flow_result):
+    """
+    Writes the combined JSON, the sequence flows and the rendered SVG of one document.
+    """
+    from bp_logic_visualizer import visualize_bpmn, generate_dot_from_sequence
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, "result.json"), "w", encoding="utf-8") as file:
+        file.write(result)
+    with open(os.path.join(directory, "sequence_flows.json"), "w", encoding="utf-8") as file:
+        file.write(sequence_flow_result)
+
+    data = json.loads(sequence_flow_result)
+    sequence_flows = data[0]["SequenceFlows"] if isinstance(data, list) else data["SequenceFlows"]
+    bp_dot = generate_dot_from_sequence(sequence_flows)
+    visualize_bpmn(bp_dot, file_name="bpm_model", directory=directory, file_format="svg", view=False)
+
+def process_document(doc_id, description, output_dir, fused=True, timeout=None):
+    """
+    Runs the pipeline over one document and writes its outputs.
+
+    Parameters:
+        timeout (float): Optional time budget of the document in seconds; a document exceeding it fails.
+
+    Returns:
+        dict: The document's latency, token usage and cost, or its error.
+    """
+    start_time = time.time()
+    cancel_token = CancellationToken(timeout) if timeout is not None else None
+    try:
+        model, records = run_pipeline(description, on_step_done=None, fused=fused, cancel_token=cancel_token)
+        write_document_outputs(document_dir(output_dir, doc_id), model.to_json(), sequence_flow_result(model, records))
+    except Exception as e:
+        return {"id": doc_id, "error": str(e), "latency": time.time() - start_time}
+
+    prompt_tokens = 0
+    completion_tokens = 0
+    for record in records.values():
+        prompt_tokens, completion_tokens = update_total_tokens(record["prompt_tokens"], record["completion_tokens"], prompt_tokens, completion_tokens)
+    return {
+        "id": doc_id,
+        "error": None,
+        "latency": time.time() - start_time,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost": records_cost(records)["total_cost"],
+        "skipped_steps": {name: record["skipped"] for name, record in records.items() if record["skipped"]},
+        "attempted_models": attempted_models(records),
+    }
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_corpus(descriptions, output_dir=DEFAULT_OUTPUT_DIR, workers=DEFAULT_WORKERS, fused=True, timeout=None):
+    """
+    Runs the pipeline over every description with at most `workers` documents in flight.
+
+    Parameters:
+        descriptions (dict): Document id -> textual description of the business process.
+        output_dir (str): The directory receiving one sub-directory of outputs per document.
+        workers (int): The number of documents processed at the same time.
+        fused (bool): Whether short descriptions are tried with the fused single-call extraction first.
+        timeout (float): Optional time budget per document in seconds, counted from the start of its run.
+
+    Returns:
+        dict: The per-document statistics ("documents") and the aggregate summary ("summary").
+    """
+    print(f"Processing up to {workers} documents at a time, one step per document")
+    start_time = time.time()
+    documents = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_document, doc_id, description, output_dir, fused, timeout) for doc_id, description in descriptions.items()]
+        for future in as_completed(futures):
+            document = future.result()
+            documents.append(document)
+            status = "ERROR " + document["error"] if document["error"] else "DONE"
+            print(f"[{len(documents)}/{len(futures)}] {document['id']} ===> {status} ({document['latency']:.2f} s)")
+    wall_time = time.time() - start_time
+
+    completed = [document for document in documents if document["error"] is None]
+    latencies = [document["latency"] for document in completed]
+    summary = {
+        "documents": len(documents),
+        "completed": len(completed),
+        "failed": len(documents) - len(completed),
+        "wall_time": wall_time,
+        "documents_per_minute": 60.0 * len(completed) / wall_time if wall_time > 0 else 0.0,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "latency_p50": percentile(latencies, 0.50) if latencies else 0.0,
+        "latency_p95": percentile(latencies, 0.95) if latencies else 0.0,
+        "prompt_tokens": sum(document["prompt_tokens"] for document in completed),
+        "completion_tokens": sum(document["completion_tokens"] for document in completed),
+        "total_cost": sum(document["cost"] for document in completed),
+        "skipped_steps": {},
+        "escalations": escalation_rates(document["attempted_models"] for document in completed),
+    }
+    for document in completed:
+        for name in document["skipped_steps"]:
+            summary["skipped_steps"][name] = summary["skipped_steps"].get(name, 0) + 1
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as file:
+        json.dump({"summary": summary, "documents": documents}, file, indent=4)
+    return {"documents": documents, "summary": summary}
+
+def print_summary(summary):
+    print(f"Documents: {summary['completed']} completed, {summary['failed']} failed")
+    print(f"Total Computation time: {summary['wall_time']:.4f} seconds ({summary['documents_per_minute']:.2f} documents/minute)")
+    print(f"Latency per document: mean {summary['latency_mean']:.2f} s, p50 {summary['latency_p50']:.2f} s, p95 {summary['latency_p95']:.2f} s")
+    print(f"Tokens: {summary['prompt_tokens']} prompt, {summary['completion_tokens']} completion")
+    print(f"Total Cost: ${summary['total_cost']:.8f}")
+    for name, count in summary["skipped_steps"].items():
+        print(f"Skipped {name} for {count} of {summary['completed']} documents")
+    for name, stats in summary["escalations"].items():
+        print(f"Escalated {name} in {stats['escalated']} of {stats['runs']} runs ({stats['rate']:.0%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate process models for a corpus of textual descriptions.")
+    parser.add_argument("source", help="directory of .txt descriptions or JSONL file with id/description objects")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="output directory (one sub-directory per document)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="number of documents processed concurrently (each runs one step at a time)")
+    parser.add_argument("--no-warmup", action="store_true", help="skip opening LLM connections before the first document")
+    parser.add_argument("--no-fused", action="store_true", help="always run the staged pipeline, also for short descriptions")
+    parser.add_argument("--no-gating", action="store_true", help="run every step, also where a local check shows it cannot change the model")
+    parser.add_argument("--no-cascade", action="store_true", help="run every step on its own model, without trying the cheaper models first")
+    parser.add_argument("--timeout", type=float, default=None, help="time budget per document in seconds; documents exceeding it fail")
+    parser.add_argument("--resume", action="store_true", help="checkpoint every step and restore the steps finished by an earlier run")
+    parser.add_argument("--checkpoints", default=DEFAULT_CHECKPOINT_PATH, help="checkpoint database used with --resume")
+    args = parser.parse_args()
+
+    from llm_completion import warmup, shutdown
+
+    if args.no_gating:
+        disable_step_gating()
+    if args.no_cascade:
+        disable_model_cascade()
+    if args.resume:
+        enable_step_checkpoints(args.checkpoints)
+    descriptions = load_descriptions(args.source)
+    print(f"Loaded {len(descriptions)} descriptions from {args.source}")
+    if not args.no_warmup:
+        warmup()
+    try:
+        corpus = run_corpus(descriptions, args.output, args.workers, fused=not args.no_fused, timeout=args.timeout)
+    finally:
+        shutdown()
+    print_summary(corpus["summary"])
+
+if __name__ == "__main__":
+    main()
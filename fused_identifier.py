@@ -0,0 +1,215 @@
+#%%
+# FUSED EXTRACTION - ALL PROCESS MODEL ELEMENTS IN ONE CALL (SHORT DESCRIPTIONS)
+# Combines the tasks of context understanding, action, action flow, gateway, loop and sequence flow
+# identification into a single schema-constrained (or JSON-mode) request. main_pipeline uses it for short descriptions and falls back to
+# the staged pipeline when the result fails local validation (model_validation).
+import re
+from typing import List
+from structured_output import StepOutput, structured_completion, astructured_completion
+from context_understanding import Participant
+from actions_identifier import ActivityEvent, ActivitiesOutput
+from actionInstances_identifier import ActionFlow
+from gateways_identifier import Gateway
+from loops_identifier import Loop
+from sequenceFlows_identifier import SequenceFlow
+
+# Constants for system and user messages
+delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description"]
+# Descriptions up to this many words are short enough for one call
+FUSED_MAX_WORDS = 150
+# JSON mode for backends without structured outputs
+RESPONSE_FORMAT = {"type": "json_object"}
+MAX_TOKENS = 3000
+SYSTEM_MESSAGE_TEMPLATE = """
+You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
+
+Task:
+Understand the textual description of a BPMN process model within the delimiters ####. Build the complete process model and output it as one JSON object with keys: ModelName, Context, Scope, Objectives, Participants, StartEvent, EndEvent, ActivitiesEvents, ActionFlows, Gateways, Loops, SequenceFlows.
+
+Instructions:
+1. Context: Identify the model name, the domain (Context), the scope from start to end, the objectives and the participants with their responsibilities.
+2. Activities and Events: Identify the start event (Start_<Name>), the end event (End_<Name>), the activities (A_<Name>) and intermediate events (E_<Name>), each with the text it was derived from.
+3. Action Flows: Establish the order of the activities and events as "from"/"to" pairs, without gateways.
+4. Gateways: Identify the decision points and parallelism. Use XOR for exclusive decisions ("if", "either", "else", "depending on", "in case of"), OR for inclusive decisions ("optionally", "one or more", "and/or") and AND for parallel work ("both", "concurrently", "simultaneously", "at the same time", "while"). Name them XOR_<Name>, OR_<Name> or AND_<Name>. A split gateway is usually followed by a corresponding join gateway.
+5. Loops: Identify repeated activities ("repeat until", "loop back to", "again", "as long as") with their conditions, exit gateways and the activities in the loop. Use an empty list when there are none.
+6. Sequence Flows: Extend the action flows with the gateways. Every flow has "from" and "to" keys with the node names above; outgoing flows of split gateways carry a "condition".
+7. Validate the sequence flows before answering:
+    - A gateway either splits (one incoming flow, multiple outgoing flows) or joins (multiple incoming flows, one outgoing flow), never both and never one-in-one-out.
+    - Every node is connected and lies on a path from the start event to the end event.
+    - Cycles only occur for the identified loops.
+
+Example:
+
+Input:
+The employee onboarding process begins when a new hire submits their completed paperwork. First, the HR department reviews the submitted documents. If any documents are missing or incorrect, they are returned to the new hire for correction. This process repeats until all documents are complete and correct. Once the documents are in order, the new hire is scheduled for orientation. After attending the orientation, the new hire is assigned to their department, completing the onboarding process.
+
+Output:
+{
+    "ModelName": "Onboarding process",
+    "Context": "Human Resources",
+    "Scope": "Starts with the submission of completed paperwork by the new hire and ends with the assignment of the new hire to their department.",
+    "Objectives": "To ensure new hires complete all necessary paperwork, attend orientation, and are successfully integrated into their departments.",
+    "Participants": [
+        {"HR_Department": "Responsible for reviewing documents, scheduling orientation, and assigning new hire to the department"},
+        {"New_Hire": "Responsible for submitting paperwork and attending orientation"}
+    ],
+    "StartEvent": "Start_SubmitPaperwork",
+    "EndEvent": "End_AssignDepartment",
+    "ActivitiesEvents": [
+        {"A_ReviewDocuments": "The HR department reviews the submitted documents"},
+        {"A_ReturnForCorrection": "If any documents are missing or incorrect, they are returned to the new hire for correction"},
+        {"A_ScheduleOrientation": "Once the documents are in order, the new hire is scheduled for orientation"},
+        {"E_AttendOrientation": "After attending the orientation"},
+        {"A_AssignToDepartment": "the new hire is assigned to their department"}
+    ],
+    "ActionFlows": [
+        {"from": "Start_SubmitPaperwork", "to": "A_ReviewDocuments"},
+        {"from": "A_ReviewDocuments", "to": "A_ReturnForCorrection"},
+        {"from": "A_ReturnForCorrection", "to": "A_ReviewDocuments"},
+        {"from": "A_ReviewDocuments", "to": "A_ScheduleOrientation"},
+        {"from": "A_ScheduleOrientation", "to": "E_AttendOrientation"},
+        {"from": "E_AttendOrientation", "to": "A_AssignToDepartment"},
+        {"from": "A_AssignToDepartment", "to": "End_AssignDepartment"}
+    ],
+    "Gateways": [
+        {
+            "id": "G1",
+            "name": "XOR_ReviewDocuments",
+            "type": "XOR",
+            "classification": "split",
+            "conditions": [
+                {"condition": "If any documents are missing or incorrect", "to_node": "A_ReturnForCorrection"},
+                {"condition": "If all documents are complete and correct", "to_node": "A_ScheduleOrientation"}
+            ],
+            "from_node": ["A_ReviewDocuments"],
+            "to_nodes": ["A_ReturnForCorrection", "A_ScheduleOrientation"],
+            "reason": "If any documents are missing or incorrect, they are returned to the new hire for correction. Otherwise, the new hire is scheduled for orientation."
+        }
+    ],
+    "Loops": [
+        {
+            "LoopID": "L1",
+            "LoopDescription": "Document correction loop",
+            "Conditions": "If any documents are missing or incorrect",
+            "GatewaysForLoopEntries": [],
+            "GatewaysForLoopExits": [{"LoopExit1": "XOR_ReviewDocuments"}],
+            "ActivitiesInLoop": ["A_ReviewDocuments", "A_ReturnForCorrection"]
+        }
+    ],
+    "SequenceFlows": [
+        {"from": "Start_SubmitPaperwork", "to": "A_ReviewDocuments"},
+        {"from": "A_ReviewDocuments", "to": "XOR_ReviewDocuments"},
+        {"from": "XOR_ReviewDocuments", "to": "A_ReturnForCorrection", "condition": "if documents are missing or incorrect"},
+        {"from": "XOR_ReviewDocuments", "to": "A_ScheduleOrientation", "condition": "if documents are complete and correct"},
+        {"from": "A_ReturnForCorrection", "to": "A_ReviewDocuments"},
+        {"from": "A_ScheduleOrientation", "to": "E_AttendOrientation"},
+        {"from": "E_AttendOrientation", "to": "A_AssignToDepartment"},
+        {"from": "A_AssignToDepartment", "to": "End_AssignDepartment"}
+    ]
+}
+"""
+
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class FusedOutput(StepOutput):
+    ModelName: str
+    Context: str
+    Scope: str
+    Objectives: str
+    Participants: List[Participant]
+    StartEvent: str
+    EndEvent: str
+    ActivitiesEvents: List[ActivityEvent]
+    ActionFlows: List[ActionFlow]
+    Gateways: List[Gateway]
+    Loops: List[Loop]
+    SequenceFlows: List[SequenceFlow]
+
+    def to_output(self):
+        output = super().to_output()
+        output["Participants"] = [{participant.name: participant.responsibility} for participant in self.Participants]
+        output["ActivitiesEvents"] = ActivitiesOutput(StartEvent=self.StartEvent, EndEvent=self.EndEvent, ActivitiesEvents=self.ActivitiesEvents).to_output()["ActivitiesEvents"]
+        output["Loops"] = [loop.to_output() for loop in self.Loops]
+        return output
+
+OUTPUT_SCHEMA = FusedOutput
+
+def is_short_description(text, max_words=FUSED_MAX_WORDS):
+    """
+    Returns:
+        bool: True when the description is short enough for the fused single-call extraction.
+    """
+    return len(re.findall(r"\S+", text)) <= max_words
+
+def construct_user_message(text):
+    """
+    Constructs the user message by wrapping the text with delimiters.
+
+    Parameters:
+        text (str): The textual description of the business process.
+
+    Returns:
+        str: The user message wrapped with delimiters.
+    """
+    return f"####{text}####"
+
+def construct_messages(system_message, user_message):
+    """
+    Constructs the message payload for the API request.
+
+    Parameters:
+        system_message (str): The system message containing instructions.
+        user_message (str): The user message containing the process description.
+
+    Returns:
+        list: A list of message dictionaries.
+    """
+    return [
+        {'role': 'system', 'content': system_message},
+        {'role': 'user', 'content': user_message}
+    ]
+
+def build_messages(text):
+    """
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        list: A list of message dictionaries.
+    """
+    system_message = SYSTEM_MESSAGE_TEMPLATE
+    user_message = construct_user_message(text)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies the complete process model of a short business process description in one request.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        tuple: The JSON response, prompt tokens and completion tokens.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, MAX_TOKENS, on_chunk=on_chunk, fallback_format=RESPONSE_FORMAT)
+    return response, prompt_tokens, completion_tokens
+
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, MAX_TOKENS, on_chunk=on_chunk, fallback_format=RESPONSE_FORMAT)
+    return response, prompt_tokens, completion_tokens
+
+# Example usage
+if __name__ == "__main__":
+    text_description = """
+    In the treasury minister’s office, once a ministerial inquiry has been received, it is first registered into the system. Then the inquiry is investigated so that a ministerial response can be prepared. The finalization of a response includes the preparation of the response itself by the cabinet officer and the review of the response by the principal registrar. If the registrar does not approve the response, the latter needs to be prepared again by the cabinet officer for review. The process finishes only once the response has been approved.
+    """
+    result, prompt_tokens, completion_tokens = identify_from_message(text_description, api="openai", model="gpt-4o-mini", temperature=0.0)
+    print(result)
+
+# %%
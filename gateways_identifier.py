@@ -2,10 +2,16 @@
 #%%
 # STEP 4 - GATEWAYS IDENTIFICATION
 import json
-from llm_completion import get_completion
+from typing import List, Literal
+from pydantic import BaseModel, Field
+from structured_output import StepOutput, structured_completion, astructured_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description", "ModelName", "Context", "Participants", "StartEvent", "EndEvent", "ActivitiesEvents", "ActionFlows"]
+# Fields sent as names/ids only (see process_model.FIELD_SUMMARIES)
+SUMMARY_FIELDS = ["Participants", "ActivitiesEvents"]
 SYSTEM_MESSAGE_TEMPLATE = """
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
@@ -73,14 +79,13 @@ To accurately identify gateways for decision points and parallelism in BPMN, you
                 Path 1: Task: Technical approval
                 Path 2: Task: Financial approval
 
-TASK: Given the process description and the list of Activities/Events (also called "Nodes") identified from this description within the delimiters {delimiter}. Output a Python list of JSON objects. Ensure the output is strictly in JSON format without any additional text. Please Identify as many gateways as you can by performing the following steps:
+TASK: Given the process description and the list of Activities/Events (also called "Nodes") identified from this description within the delimiters {delimiter}. Output a Python list of JSON objects. Please Identify as many gateways as you can by performing the following steps:
 
 Instructions:
 - Read Thoroughly: Carefully read the textual description of the business process to grasp the overall objective, scope, and details. Try to identify gateways.
 - Using the list of provided "ActivitiesEvent", identify gateways along with textual clues that led to the decision. Let use  and the list of provided "ActionFlows" to infer the "from_node" and "to_node" of each gateways
 - Identify as many gateways as you can, whether they are for divergence (such as XOR-split, OR-split, or AND-split) or convergence (such as XOR-join, OR-join, or AND-join). Generally, if a process has a split gateway (e.g., XOR-split, OR-split, or AND-split), it will be followed by a corresponding join gateway (e.g., XOR-join, OR-join, or AND-join) to converge the paths. However, this is not always the case; several split gateways could converge into a single join gateway.
-- Output a Python list of JSON objects, detailing the gateways identified in Step 1. Ensure the output is strictly in JSON format without any additional text. Do not print out Step 1.
-- DO NOT output additional text except the JSON format. Do not output ```json or ```. Do not output comment "//"
+- Output a Python list of JSON objects, detailing the gateways identified in Step 1. Do not print out Step 1.
 
 JSON Object Structure
 - total_gateways: Total number of gateways identified. total_gateways = total_XOR_split + total_XOR_join + total_AND_split + total_AND_join + total_OR_split + total_OR_join
@@ -108,21 +113,10 @@ The employee onboarding process begins when a new hire submits their completed p
     {
         "ModelName": "Onboarding process",
         "Context": "Human Resources",
-        "Scope": "Starts with the submission of completed paperwork by the new hire and ends with the assignment of the new hire to their department.",
-        "Objectives": "To ensure new hires complete all necessary paperwork, attend orientation, and are successfully integrated into their departments.",
-        "Participants": [
-            {"HR_Department": "Responsible for reviewing documents, scheduling orientation, and assigning new hire to the department"},
-            {"New_Hire": "Responsible for submitting paperwork and attending orientation"}
-        ],
+        "Participants": ["HR_Department", "New_Hire"],
         "StartEvent": "Start_SubmitPaperwork",
         "EndEvent": "End_AssignDepartment",
-        "ActivitiesEvents": [
-            {"A_ReviewDocuments": "The HR department reviews the submitted documents"},
-            {"A_ReturnForCorrection": "If any documents are missing or incorrect, they are returned to the new hire for correction"},
-            {"A_ScheduleOrientation": "Once the documents are in order, the new hire is scheduled for orientation"},
-            {"E_AttendOrientation": "After attending the orientation"},
-            {"A_AssignToDepartment": "the new hire is assigned to their department"}
-        ],
+        "ActivitiesEvents": ["A_ReviewDocuments", "A_ReturnForCorrection", "A_ScheduleOrientation", "E_AttendOrientation", "A_AssignToDepartment"],
         "ActionFlows": [
             {"from": "Start_SubmitPaperwork", "to": "A_ReviewDocuments"},
             {"from": "A_ReviewDocuments", "to": "A_ReturnForCorrection"},
@@ -421,6 +415,33 @@ Output:
 # - Generally, if a process has a split gateway (e.g., XOR-split, OR-split, or AND-split), it will be followed by a corresponding join gateway (e.g., XOR-join, OR-join, or AND-join) to converge the paths. However, this is not always the case, as some processes may diverge without needing an explicit convergence.
 # - Ensure the output is strictly in JSON format without any additional text.
 
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class GatewayCondition(BaseModel):
+    condition: str
+    to_node: str
+
+class Gateway(BaseModel):
+    id: str
+    name: str = Field(description="XOR_<Name>, OR_<Name> or AND_<Name>")
+    type: Literal["XOR", "OR", "AND"]
+    classification: Literal["split", "join"]
+    conditions: List[GatewayCondition]
+    from_node: List[str]
+    to_nodes: List[str]
+    reason: str
+
+class GatewaysOutput(StepOutput):
+    total_gateways: int
+    total_XOR_split: int
+    total_XOR_join: int
+    total_AND_split: int
+    total_AND_join: int
+    total_OR_split: int
+    total_OR_join: int
+    Gateways: List[Gateway]
+
+OUTPUT_SCHEMA = GatewaysOutput
+
 def construct_user_message(text):
     """
     Constructs the user message by wrapping the text with delimiters.
@@ -449,26 +470,45 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
-    Identifies gateways in a business process description.
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified gateways and related metadata.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies gateways in a business process description.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified gateways and related metadata.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
@@ -2,10 +2,14 @@
 #%%
 # STEP 1 - INPUT AUGMENTATION
 import json
-from llm_completion import get_completion
+from llm_completion import get_completion, aget_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description"]
+# The output is plain text, so there is no output schema (see structured_output)
+OUTPUT_SCHEMA = None
 SYSTEM_MESSAGE_TEMPLATE = """
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
@@ -259,25 +263,44 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified gateways and related metadata.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE_NEW_8_12_2024
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified gateways and related metadata.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await aget_completion(messages, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
@@ -0,0 +1,248 @@
+#%%
+# BACKGROUND JOB QUEUE
+# Runs long jobs (a pipeline run plus rendering) on a fixed pool of worker threads behind a bounded queue, so web
+# request threads only enqueue a job and return its id. Every job carries a CancellationToken: a queued job can be
+# cancelled before it starts and a running job stops launching LLM calls (see cancellation). Jobs publish progress
+# events to an event log that clients can follow while the job runs and replay afterwards. Finished jobs are kept
+# for status requests until the newest max_finished_jobs push them out.
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from cancellation import CancellationToken, PipelineCancelled, DeadlineExceeded
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_DEPTH = 64
+DEFAULT_MAX_FINISHED_JOBS = 200
+# The last event of every job is named after its final status
+FINAL_STATUSES = ("done", "failed", "cancelled")
+
+class QueueFull(Exception):
+    """
+    Raised by JobQueue.submit when queue_depth jobs are already waiting.
+    """
+
+class Job:
+    """
+    One queued call of function(*args, cancel_token=..., publish=...).
+
+    Attributes:
+        id (str): The job id.
+        status (str): "queued", "running", "done", "failed" or "cancelled".
+        result: The function's return value once the job is done.
+        error (str): The error message of a failed or cancelled job.
+        events (list): The (event, data) pairs published so far: "running", whatever the function publishes and
+            finally the job's final status with to_dict().
+    """
+
+    def __init__(self, function, args, timeout=None):
+        self.id = uuid.uuid4().hex
+        self.function = function
+        self.args = args
+        self.timeout = timeout
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.cancel_token = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self._events_changed = threading.Condition()
+
+    def publish(self, event, data=None):
+        """
+        Appends an event to the job's event log and wakes up the clients waiting for it.
+        """
+        with self._events_changed:
+            self.events.append((event, data))
+            self._events_changed.notify_all()
+
+    def events_since(self, index, timeout=None):
+        """
+        Returns the events from index on, waiting up to timeout seconds for the next one when there are none yet.
+
+        Returns:
+            list: The (event, data) pairs, empty when the timeout passed without a new event.
+        """
+        with self._events_changed:
+            if len(self.events) <= index:
+                self._events_changed.wait(timeout)
+            return self.events[index:]
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The job's id, status, error and timings (seconds in the queue and running).
+        """
+        now = time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "queued_seconds": (self.started or self.finished or now) - self.created,
+            "running_seconds": (self.finished or now) - self.started if self.started else 0.0,
+        }
+
+class JobQueue:
+    """
+    Bounded job queue served by a pool of worker threads. Thread-safe; the workers start with the first job.
+
+    Parameters:
+        workers (int): The number of jobs running at the same time.
+        queue_depth (int): The number of jobs that may wait for a worker; further submissions raise QueueFull.
+        max_finished_jobs (int): The number of finished jobs kept for status requests.
+        on_evict (callable): Optional callback on_evict(job) for finished jobs that are forgotten, e.g. to delete
+            their output files.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_depth=DEFAULT_QUEUE_DEPTH, max_finished_jobs=DEFAULT_MAX_FINISHED_JOBS, on_evict=None):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.max_finished_jobs = max_finished_jobs
+        self.on_evict = on_evict
+        # Unbounded: queue_depth limits the jobs still waiting (_waiting), so cancelled jobs left in the queue until
+        # a worker discards them do not take up places
+        self._queue = queue.Queue()
+        self._waiting = 0
+        self._jobs = {}
+        self._finished = OrderedDict()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start_workers(self):
+        # Called with the lock held
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, function, *args, timeout=None):
+        """
+        Queues the call function(*args, cancel_token=..., publish=...).
+
+        Parameters:
+            function (callable): The job; it receives the job's CancellationToken as cancel_token and
+                Job.publish as publish, to report progress events.
+            timeout (float): Optional time budget in seconds, counted from the start of the job.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            QueueFull: If queue_depth jobs are already waiting.
+        """
+        job = Job(function, args, timeout)
+        with self._lock:
+            if self._waiting >= self.queue_depth:
+                raise QueueFull(f"Error: {self.queue_depth} jobs are already waiting.")
+            self._start_workers()
+            self._waiting += 1
+            self._jobs[job.id] = job
+            self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns:
+            Job: The queued, running or finished job, or None when the id is unknown or forgotten.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, reason="cancelled"):
+        """
+        Cancels a job: a queued job is finished right away and never starts, a running one stops at its next step
+        or LLM call.
+
+        Returns:
+            bool: True when the job was still queued or running.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ("queued", "running"):
+                return False
+            if job.status == "running":
+                job.cancel_token.cancel(reason)
+                return True
+            job.status = "cancelled"
+            job.error = f"Job cancelled: {reason}"
+            self._waiting -= 1
+            evicted = self._finish(job)
+        job.publish(job.status, job.to_dict())
+        self._evict(evicted)
+        return True
+
+    def queued_jobs(self):
+        """
+        Returns:
+            int: The number of jobs waiting for a worker, not counting cancelled ones.
+        """
+        with self._lock:
+            return self._waiting
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        with self._lock:
+            if job.status != "queued":
+                return # Cancelled while it was waiting
+            self._waiting -= 1
+            job.status = "running"
+            job.started = time.time()
+            job.cancel_token = CancellationToken(job.timeout)
+        job.publish("running", job.to_dict())
+        try:
+            result = job.function(*job.args, cancel_token=job.cancel_token, publish=job.publish)
+            status, error = "done", None
+        except DeadlineExceeded as e:
+            result, status, error = None, "failed", str(e)
+        except PipelineCancelled as e:
+            result, status, error = None, "cancelled", str(e)
+        except Exception as e:
+            print(f"Job {job.id} ===> Error: {e}")
+            traceback.print_exc()
+            result, status, error = None, "failed", str(e)
+        with self._lock:
+            job.result, job.status, job.error = result, status, error
+            evicted = self._finish(job)
+        job.publish(job.status, job.to_dict())
+        self._evict(evicted)
+
+    def _finish(self, job):
+        # Called with the lock held; forgets the oldest finished jobs beyond max_finished_jobs and returns them
+        job.finished = time.time()
+        self._finished[job.id] = job
+        evicted = []
+        while len(self._finished) > self.max_finished_jobs:
+            _, old_job = self._finished.popitem(last=False)
+            del self._jobs[old_job.id]
+            evicted.append(old_job)
+        return evicted
+
+    def _evict(self, evicted):
+        if self.on_evict is not None:
+            for job in evicted:
+                self.on_evict(job)
+
+    def shutdown(self):
+        """
+        Cancels the queued and running jobs and stops the workers once their current jobs ended.
+        """
+        with self._lock:
+            jobs = [job.id for job in self._jobs.values() if job.status in ("queued", "running")]
+            threads = list(self._threads)
+        for job_id in jobs:
+            self.cancel(job_id, "server shutdown")
+        for _ in threads:
+            self._queue.put(None)
@@ -0,0 +1,206 @@
+#%%
+# TOLERANT JSON RECOVERY FOR STEP OUTPUTS
+# Recovers the JSON of a free-text step response locally: takes the contents of its ```json code block if it has
+# one, otherwise strips code fences and surrounding commentary, extracts the outermost JSON array or object, and
+# repairs common defects (comments, trailing or missing commas between
+# objects, single quotes, Python literals). A response cut off before its closing brackets is reported as
+# truncated, so the caller can request only the missing rest (see structured_output).
+import json
+import re
+
+FENCE_PATTERN = re.compile(r"```[A-Za-z]*[ \t]*\n?")
+# A code block with its language tag and contents; an unclosed block runs to the end of the text
+FENCED_BLOCK_PATTERN = re.compile(r"```([A-Za-z]*)[ \t]*\n?(.*?)(?:```|\Z)", re.DOTALL)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSING = {"[": "]", "{": "}"}
+
+class TruncatedJSONError(ValueError):
+    """
+    Raised when a response ends inside its JSON value, e.g. because it hit the completion token limit.
+    """
+
+def strip_fences(text):
+    """
+    Returns:
+        str: The text without Markdown code fences (```json ... ```).
+    """
+    return FENCE_PATTERN.sub("", text)
+
+def fenced_block(text):
+    """
+    Returns:
+        str: The contents of the first ```json code block, or of the first code block when none is tagged as JSON,
+        up to the end of the text when its closing fence is missing. None when the text has no code block.
+    """
+    blocks = FENCED_BLOCK_PATTERN.findall(text)
+    if not blocks:
+        return None
+    for language, contents in blocks:
+        if language.lower() == "json":
+            return contents
+    return blocks[0][1]
+
+def extract_json_span(text):
+    """
+    Finds the outermost JSON array or object of a text.
+
+    Returns:
+        tuple: The JSON text (from its first bracket up to the matching closing bracket, or the end of the text
+        when it is never closed) and whether it is complete.
+
+    Raises:
+        ValueError: If the text contains no JSON array or object.
+    """
+    match = re.search(r"[\[{]", text)
+    if match is None:
+        raise ValueError("Error: no JSON array or object in the response.")
+    stack = []
+    quote = None
+    escaped = False
+    for index in range(match.start(), len(text)):
+        char = text[index]
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in CLOSING:
+            stack.append(CLOSING[char])
+        elif char in "]}":
+            if stack and stack[-1] == char:
+                stack.pop()
+            if not stack:
+                return text[match.start():index + 1], True
+    return text[match.start():], False
+
+def _skip_comment(text, index):
+    # Returns the index after a // or /* */ comment starting at index, or None when there is none
+    if text.startswith("//", index):
+        end = text.find("\n", index)
+        return len(text) if end == -1 else end
+    if text.startswith("/*", index):
+        end = text.find("*/", index + 2)
+        return len(text) if end == -1 else end + 2
+    return None
+
+def repair_json(text):
+    """
+    Repairs common defects of LLM-written JSON outside of strings: comments, trailing commas, missing commas
+    between objects or arrays, single-quoted strings and the Python literals True, False and None.
+    """
+    out = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char in "\"'":
+            # Copy the string, re-quoting single-quoted ones with double quotes
+            end = index + 1
+            while end < len(text) and text[end] != char:
+                end += 2 if text[end] == "\\" else 1
+            content = text[index + 1:end]
+            if char == "'":
+                content = content.replace("\\'", "'").replace('"', '\\"')
+            out.append('"' + content + '"')
+            index = end + 1
+            continue
+        comment_end = _skip_comment(text, index)
+        if comment_end is not None:
+            index = comment_end
+            continue
+        if char in "]}":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        elif char in "[{":
+            previous = len(out) - 1
+            while previous >= 0 and out[previous].isspace():
+                previous -= 1
+            if previous >= 0 and out[previous] in ("]", "}"):
+                out.append(",")
+        word = re.match(r"[A-Za-z]+", text[index:])
+        if word is not None:
+            out.append(PYTHON_LITERALS.get(word.group(), word.group()))
+            index += len(word.group())
+            continue
+        out.append(char)
+        index += 1
+    return "".join(out)
+
+def recover_json(text):
+    """
+    Parses the JSON of a step response, recovering it from fences, commentary and common defects.
+
+    Parameters:
+        text (str): The raw response text.
+
+    Returns:
+        The parsed JSON value.
+
+    Raises:
+        TruncatedJSONError: If the response ends before the JSON value is complete.
+        ValueError: If no valid JSON can be recovered.
+    """
+    if not text:
+        raise ValueError("Error: the response is empty.")
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    # Commentary around a code block may contain brackets of its own, so the block is tried first
+    block = fenced_block(text)
+    if block is not None:
+        try:
+            return _recover_span(block)
+        except TruncatedJSONError:
+            raise
+        except ValueError:
+            pass
+    return _recover_span(strip_fences(text))
+
+def _recover_span(text):
+    # Parses the outermost JSON value of text, repairing it if needed
+    span, complete = extract_json_span(text)
+    if not complete:
+        raise TruncatedJSONError("Error: the JSON in the response is truncated.")
+    try:
+        return json.loads(span)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(repair_json(span))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Error: the response is not valid JSON and could not be repaired: {e}")
+
+def recover_json_text(text):
+    """
+    Returns:
+        str: The response itself when it is valid JSON, otherwise the recovered JSON re-serialized.
+    """
+    try:
+        json.loads(text or "")
+        return text
+    except json.JSONDecodeError:
+        return json.dumps(recover_json(text), indent=4, ensure_ascii=False)
+
+CONTINUATION_PROMPT = "Your answer was cut off. Continue the JSON exactly where it stopped, without repeating any of it and without any other text."
+
+def continuation_messages(messages, partial):
+    """
+    Returns:
+        list: The messages asking the model to continue its truncated answer.
+    """
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUATION_PROMPT},
+    ]
+
+def join_continuation(partial, continuation):
+    """
+    Appends a continuation to the truncated answer; a fence opening the continuation is dropped.
+    """
+    return partial + re.sub(r"^\s*```[A-Za-z]*[ \t]*\n?", "", continuation)
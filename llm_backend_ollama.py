@@ -0,0 +1,100 @@
+#%%
+# LLM BACKEND - OLLAMA
+import threading
+import ollama
+from langchain_ollama import ChatOllama
+
+NUM_CTX = 4096
+# How long Ollama keeps the model loaded after a request, so the pipeline steps do not reload it in between
+KEEP_ALIVE = "30m"
+# Response formats are mapped to format="json" (see ollama_format), which constrains the syntax but not the schema
+SUPPORTS_JSON_SCHEMA = False
+# Per-request timeouts are not passed on: the shared ChatOllama instances fix their HTTP client's timeout. A pipeline
+# deadline still stops streamed responses at the next delta and keeps further calls from starting.
+
+# One resident chat model per (model, options); ChatOllama instances are safe to share between threads
+_chat_models = {}
+_lock = threading.Lock()
+
+def get_chat_model(model, temperature, max_tokens, num_ctx=NUM_CTX, keep_alive=KEEP_ALIVE, output_format=None):
+    """
+    Returns the cached ChatOllama instance for the given model and options.
+
+    Parameters:
+        model (str): The Ollama model name, e.g. "llama3.1" or "phi3".
+        temperature (float): The sampling temperature.
+        max_tokens (int): The completion token limit (num_predict).
+        num_ctx (int): The context window size.
+        keep_alive (str): How long the model stays loaded after each request.
+        output_format: Ollama's format option, "json" to constrain the output to JSON.
+
+    Returns:
+        ChatOllama: The shared chat model.
+    """
+    key = (model, temperature, max_tokens, num_ctx, keep_alive, output_format)
+    chat_model = _chat_models.get(key)
+    if chat_model is None:
+        with _lock:
+            chat_model = _chat_models.get(key)
+            if chat_model is None:
+                chat_model = ChatOllama(
+                    model=model,
+                    temperature=temperature,
+                    num_ctx=num_ctx,
+                    num_predict=max_tokens,
+                    keep_alive=keep_alive,
+                    format=output_format,
+                )
+                _chat_models[key] = chat_model
+    return chat_model
+
+def _token_counts(message):
+    # Ollama reports prompt_eval_count/eval_count with the final response (the last chunk when streaming)
+    metadata = message.response_metadata or {}
+    return metadata.get("prompt_eval_count", 0) or 0, metadata.get("eval_count", 0) or 0
+
+def ollama_format(response_format):
+    # Ollama only distinguishes free text from JSON output
+    if response_format is None:
+        return None
+    return "json"
+
+def complete(messages, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    chat_model = get_chat_model(model, temperature, max_tokens, output_format=ollama_format(response_format))
+    if on_chunk is None:
+        response = chat_model.invoke(messages)
+        prompt_tokens, completion_tokens = _token_counts(response)
+        return response.content, prompt_tokens, completion_tokens
+
+    parts = []
+    prompt_tokens = 0
+    completion_tokens = 0
+    for chunk in chat_model.stream(messages):
+        if chunk.content:
+            parts.append(chunk.content)
+            on_chunk(chunk.content)
+        if chunk.response_metadata.get("eval_count") is not None:
+            prompt_tokens, completion_tokens = _token_counts(chunk)
+    return "".join(parts), prompt_tokens, completion_tokens
+
+async def acomplete(messages, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    chat_model = get_chat_model(model, temperature, max_tokens, output_format=ollama_format(response_format))
+    if on_chunk is None:
+        response = await chat_model.ainvoke(messages)
+        prompt_tokens, completion_tokens = _token_counts(response)
+        return response.content, prompt_tokens, completion_tokens
+
+    parts = []
+    prompt_tokens = 0
+    completion_tokens = 0
+    async for chunk in chat_model.astream(messages):
+        if chunk.content:
+            parts.append(chunk.content)
+            on_chunk(chunk.content)
+        if chunk.response_metadata.get("eval_count") is not None:
+            prompt_tokens, completion_tokens = _token_counts(chunk)
+    return "".join(parts), prompt_tokens, completion_tokens
+
+def warmup(model):
+    # A generate request without a prompt only loads the model into memory
+    ollama.Client().generate(model=model, keep_alive=KEEP_ALIVE)
@@ -0,0 +1,111 @@
+#%%
+# LLM BACKEND - OPENAI (ALSO USED FOR OPENAI-COMPATIBLE ENDPOINTS)
+from config import OPENAI_API_KEY
+from llm_clients import get_openai_client, get_async_openai_client
+
+# Chat Completions enforces {"type": "json_schema", "json_schema": {..., "strict": True}} response formats
+SUPPORTS_JSON_SCHEMA = True
+
+def request_options(response_format, timeout=None):
+    # Optional request parameters, only sent when set so endpoints without support for them are not affected.
+    # timeout overrides the client's REQUEST_TIMEOUT for this request, e.g. with the time left of a pipeline run.
+    options = {}
+    if response_format is not None:
+        options["response_format"] = response_format
+    if timeout is not None:
+        options["timeout"] = timeout
+    return options
+
+def chat_completion(client, messages, model, temperature, max_tokens, on_chunk=None, strip_newlines=False, response_format=None, timeout=None):
+    """
+    Calls an OpenAI-compatible Chat Completions endpoint, streaming deltas to on_chunk when it is given.
+
+    Returns:
+        tuple: The result text, prompt tokens and completion tokens.
+    """
+    if on_chunk is None:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **request_options(response_format, timeout),
+        )
+        result = response.choices[0].message.content
+        if strip_newlines:
+            result = result.replace("\n", "")
+        return result, response.usage.prompt_tokens, response.usage.completion_tokens
+
+    prompt_tokens = 0
+    completion_tokens = 0
+    parts = []
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}, # usage arrives in a final chunk without choices
+        **request_options(response_format, timeout),
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            delta = chunk.choices[0].delta.content
+            if strip_newlines:
+                delta = delta.replace("\n", "")
+            parts.append(delta)
+            on_chunk(delta)
+        if chunk.usage is not None:
+            prompt_tokens = chunk.usage.prompt_tokens
+            completion_tokens = chunk.usage.completion_tokens
+    return "".join(parts), prompt_tokens, completion_tokens
+
+async def achat_completion(client, messages, model, temperature, max_tokens, on_chunk=None, strip_newlines=False, response_format=None, timeout=None):
+    if on_chunk is None:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **request_options(response_format, timeout),
+        )
+        result = response.choices[0].message.content
+        if strip_newlines:
+            result = result.replace("\n", "")
+        return result, response.usage.prompt_tokens, response.usage.completion_tokens
+
+    prompt_tokens = 0
+    completion_tokens = 0
+    parts = []
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+        **request_options(response_format, timeout),
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            delta = chunk.choices[0].delta.content
+            if strip_newlines:
+                delta = delta.replace("\n", "")
+            parts.append(delta)
+            on_chunk(delta)
+        if chunk.usage is not None:
+            prompt_tokens = chunk.usage.prompt_tokens
+            completion_tokens = chunk.usage.completion_tokens
+    return "".join(parts), prompt_tokens, completion_tokens
+
+def complete(messages, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    client = get_openai_client("openai", OPENAI_API_KEY)
+    return chat_completion(client, messages, model, temperature, max_tokens, on_chunk, response_format=response_format, timeout=timeout)
+
+async def acomplete(messages, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    client = get_async_openai_client("openai", OPENAI_API_KEY)
+    return await achat_completion(client, messages, model, temperature, max_tokens, on_chunk, response_format=response_format, timeout=timeout)
+
+def warmup(model):
+    # Opens the pooled HTTPS connection and checks the model without spending tokens
+    get_openai_client("openai", OPENAI_API_KEY).models.retrieve(model)
@@ -0,0 +1,28 @@
+#%%
+# LLM BACKEND - VERTEX AI (LLAMA 3.1 THROUGH THE OPENAI-COMPATIBLE ENDPOINT)
+from llm_clients import get_openai_client, get_async_openai_client, get_http_pool
+from llm_backend_openai import chat_completion, achat_completion
+from vertex_credentials import vertex_credentials, VERTEX_OPENAI_BASE_URL
+
+SUPPORTS_JSON_SCHEMA = False
+
+def complete(messages, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    # response_format is not sent: the Llama MaaS endpoint does not enforce it, the prompts ask for JSON instead
+    # SDK init and access token are cached per process; the token is refreshed only near expiry
+    client = get_openai_client("vertexai", vertex_credentials.get_token(), base_url=VERTEX_OPENAI_BASE_URL)
+
+    # Configure Llama 3.1 
+    #MODEL_ID = "meta/llama3-405b-instruct-maas"
+
+    # Chat
+    return chat_completion(client, messages, model, temperature, max_tokens, on_chunk, strip_newlines=True, timeout=timeout)
+
+async def acomplete(messages, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    token = await vertex_credentials.aget_token()
+    client = get_async_openai_client("vertexai", token, base_url=VERTEX_OPENAI_BASE_URL)
+    return await achat_completion(client, messages, model, temperature, max_tokens, on_chunk, strip_newlines=True, timeout=timeout)
+
+def warmup(model):
+    # Initializes the SDK, fetches the access token and opens the pooled HTTPS connection to the endpoint host
+    get_openai_client("vertexai", vertex_credentials.get_token(), base_url=VERTEX_OPENAI_BASE_URL)
+    get_http_pool("vertexai", VERTEX_OPENAI_BASE_URL).head(VERTEX_OPENAI_BASE_URL.split("/v1beta1/")[0])
@@ -0,0 +1,144 @@
+#%%
+# SHARED LLM CLIENTS (CONNECTION POOLING)
+import asyncio
+import threading
+import weakref
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+# Connection pool settings shared by every pooled client
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 60.0  # seconds an idle connection is kept open
+CONNECT_TIMEOUT = 10.0  # seconds
+REQUEST_TIMEOUT = 120.0  # seconds
+# Retries are handled by rate_limiter together with the shared quota, not by the SDK
+SDK_MAX_RETRIES = 0
+
+# One HTTP connection pool per (backend, base_url), one OpenAI client per (backend, base_url, credentials)
+_http_pools = {}
+_clients = {}
+_lock = threading.Lock()
+
+# Async connections belong to the event loop that opened them, so async pools are kept per loop
+_async_http_pools = weakref.WeakKeyDictionary()
+_async_clients = weakref.WeakKeyDictionary()
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+def _new_http_pool():
+    """
+    Creates an HTTP connection pool with keep-alive and bounded socket usage.
+
+    Returns:
+        httpx.Client: The pooled HTTP client.
+    """
+    return DefaultHttpxClient(
+        limits=_pool_limits(),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+def get_openai_client(backend, api_key, base_url=None):
+    """
+    Returns a shared, thread-safe OpenAI client for the given backend, base URL and credentials.
+    Clients for the same backend and base URL share one connection pool, so rotated credentials
+    (e.g. refreshed Vertex AI tokens) keep reusing the already established connections.
+
+    Parameters:
+        backend (str): The backend name, e.g. "openai" or "vertexai".
+        api_key (str): The API key or access token used by the client.
+        base_url (str): The API base URL, or None for the OpenAI default.
+
+    Returns:
+        OpenAI: The pooled client.
+    """
+    key = (backend, base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            pool = _http_pools.get((backend, base_url))
+            if pool is None:
+                pool = _new_http_pool()
+                _http_pools[(backend, base_url)] = pool
+            # Forget clients holding outdated credentials for the same endpoint; the pool stays open
+            for stale_key in [k for k in _clients if k[:2] == (backend, base_url)]:
+                del _clients[stale_key]
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=pool, max_retries=SDK_MAX_RETRIES)
+            _clients[key] = client
+    return client
+
+def get_http_pool(backend, base_url=None):
+    """
+    Returns the connection pool shared by the clients of the given backend and base URL, creating it if needed.
+
+    Returns:
+        httpx.Client: The pooled HTTP client.
+    """
+    with _lock:
+        pool = _http_pools.get((backend, base_url))
+        if pool is None:
+            pool = _new_http_pool()
+            _http_pools[(backend, base_url)] = pool
+    return pool
+
+def get_async_openai_client(backend, api_key, base_url=None):
+    """
+    Async counterpart of get_openai_client. Must be called from inside a running event loop;
+    the returned AsyncOpenAI client shares one connection pool per loop, backend and base URL.
+
+    Parameters:
+        backend (str): The backend name, e.g. "openai" or "vertexai".
+        api_key (str): The API key or access token used by the client.
+        base_url (str): The API base URL, or None for the OpenAI default.
+
+    Returns:
+        AsyncOpenAI: The pooled async client.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    key = (backend, base_url, api_key)
+    client = clients.get(key)
+    if client is None:
+        pools = _async_http_pools.setdefault(loop, {})
+        pool = pools.get((backend, base_url))
+        if pool is None:
+            pool = DefaultAsyncHttpxClient(
+                limits=_pool_limits(),
+                timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            )
+            pools[(backend, base_url)] = pool
+        for stale_key in [k for k in clients if k[:2] == (backend, base_url)]:
+            del clients[stale_key]
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=pool, max_retries=SDK_MAX_RETRIES)
+        clients[key] = client
+    return client
+
+def close_clients():
+    """
+    Closes all pooled connections. Call at process shutdown.
+    """
+    with _lock:
+        pools = list(_http_pools.values())
+        _http_pools.clear()
+        _clients.clear()
+    for pool in pools:
+        pool.close()
+
+async def aclose_clients():
+    """
+    Closes the async connection pools of the running event loop. Await before the loop exits.
+    """
+    loop = asyncio.get_running_loop()
+    pools = _async_http_pools.pop(loop, {})
+    _async_clients.pop(loop, None)
+    for pool in pools.values():
+        await pool.aclose()
@@ -1,78 +1,151 @@
-from openai import OpenAI
-from langchain_ollama.llms import OllamaLLM
-from config import OPENAI_API_KEY
-import os
-from google.auth import default, transport
-import openai
-
-def get_completion(messages, api="openai", model="gpt-4o-mini", temperature=0.7, max_tokens=1000):
+import importlib
+import threading
+import time
+from response_cache import get_response_cache, make_cache_key
+from rate_limiter import call_with_rate_limit, acall_with_rate_limit
+from cancellation import raise_if_cancelled, call_timeout, cancellable_chunks
+
+# Backend name -> module implementing complete()/acomplete(). Modules are imported on first use, so importing
+# the pipeline only pulls in the SDKs (OpenAI, LangChain/Ollama, Google) of the backends actually called.
+BACKEND_MODULES = {
+    "openai": "llm_backend_openai",
+    "ollama": "llm_backend_ollama",
+    "vertexai": "llm_backend_vertexai",
+}
+_loaded_backends = {}
+# (api, model) pairs used by main_pipeline.pipeline, warmed up by default
+DEFAULT_WARMUP_TARGETS = [("openai", "gpt-4o"), ("openai", "gpt-4o-mini")]
+_backends_lock = threading.Lock()
+
+def get_backend(api):
+    """
+    Returns the backend module for the given API, importing it on first use.
+
+    Parameters:
+        api (str): The backend name, e.g. "openai", "ollama" or "vertexai".
+
+    Returns:
+        module: The backend module exposing complete() and acomplete().
+    """
+    backend = _loaded_backends.get(api)
+    if backend is not None:
+        return backend
+    if api not in BACKEND_MODULES:
+        raise ValueError("Unsupported API specified. Choose 'openai', 'ollama' or 'vertexai'.")
+    with _backends_lock:
+        backend = _loaded_backends.get(api)
+        if backend is None:
+            backend = importlib.import_module(BACKEND_MODULES[api])
+            _loaded_backends[api] = backend
+    return backend
+
+def supports_json_schema(api):
+    """
+    Returns:
+        bool: True when the backend enforces JSON schema response formats (structured outputs).
+    """
+    return getattr(get_backend(api), "SUPPORTS_JSON_SCHEMA", False)
+
+def tracked_chunks(on_chunk):
+    """
+    Wraps a streaming callback to remember whether any text reached it.
+
+    Returns:
+        tuple: The wrapped callback (None without a callback) and a function returning True while no delta
+        has been passed on.
+    """
+    if on_chunk is None:
+        return None, None
+    streamed = threading.Event()
+
+    def tracked_on_chunk(delta):
+        if delta:
+            streamed.set()
+        on_chunk(delta)
+    return tracked_on_chunk, lambda: not streamed.is_set()
+
+def get_completion(messages, api="openai", model="gpt-4o-mini", temperature=0.7, max_tokens=1000, on_chunk=None, response_format=None):
     # mode: gpt-4o-mini, gpt-4o, llama3.1, meta/llama3-405b-instruct-maas
-    prompt_tokens = 0
-    completion_tokens = 0
-    if api == "openai":
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        result = response.choices[0].message.content
-        prompt_tokens= response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
-    elif api == "ollama":
-        ollama_llm = OllamaLLM(
-            model=model,
-            temperature=temperature,
-            num_ctx=4096,
-            num_predict=max_tokens,
-        )
-        result = ollama_llm.invoke(messages)
-    elif api == "vertexai":
-        # Set environment variable for Google Application Credentials
-        SERVICE_ACCOUNT_PATH = r"D:\keys\focal-healer-431902-q6-19dcf02385ff.json"
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = SERVICE_ACCOUNT_PATH
-
-        PROJECT_ID = "focal-healer-431902-q6"
-        LOCATION = "us-central1"
-        BUCKET_NAME = "mybucket"
-        BUCKET_URI = f"gs://{BUCKET_NAME}"
-
-        # Initialize Vertex AI SDK for Python
-        import vertexai
-        vertexai.init(project=PROJECT_ID, location=LOCATION, staging_bucket=BUCKET_URI)
-
-        # Authentication
-        credentials, project = default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        auth_request = transport.requests.Request()
-        credentials.refresh(auth_request)
-
-        # Configure the OpenAI SDK to point to the Llama 3.1 Chat Completions API endpoint
-        MODEL_LOCATION = "us-central1"
-        client = openai.OpenAI(
-            base_url=f"https://{MODEL_LOCATION}-aiplatform.googleapis.com/v1beta1/projects/{PROJECT_ID}/locations/{MODEL_LOCATION}/endpoints/openapi/chat/completions?",
-            api_key=credentials.token,
-        )
-
-        # Configure Llama 3.1 
-        #MODEL_ID = "meta/llama3-405b-instruct-maas"
-
-        # Chat
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        result = response.choices[0].message.content
-        result = result.replace("\n", "")
-        prompt_tokens= response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
-    else:
-        raise ValueError("Unsupported API specified. Choose 'openai' or 'ollama'.")
-    
+    # on_chunk: optional callback; when given, the backend is called with stream=True and on_chunk(delta) is
+    # invoked for every text delta as it arrives. The full result and usage counts are still returned.
+    # response_format: optional OpenAI-style response format, e.g. {"type": "json_object"}, for backends supporting it.
+    # Identical requests are answered from the response cache when it is enabled; cache hits cost no tokens.
+    # Backend calls go through the shared per-model rate limiter and are retried with backoff on transient errors.
+    # Inside a pipeline run with a deadline each call times out when the run's budget is gone (see cancellation);
+    # a cancelled run starts no further calls and stops reading streamed responses.
+    # A streamed call that fails after deltas reached on_chunk is not retried, so callers never see text twice.
+    raise_if_cancelled()
+    on_chunk, nothing_streamed = tracked_chunks(on_chunk)
+    on_chunk = cancellable_chunks(on_chunk)
+    cache = get_response_cache()
+    if cache is None:
+        return call_with_rate_limit(lambda: _completion(messages, api, model, temperature, max_tokens, on_chunk, response_format, call_timeout()), api, model, messages, max_tokens, nothing_streamed)
+
+    cache_key = make_cache_key(messages, api, model, temperature, max_tokens, response_format)
+    cached_result = cache.get(cache_key)
+    if cached_result is not None:
+        if on_chunk is not None:
+            on_chunk(cached_result)
+        return cached_result, 0, 0
+    result, prompt_tokens, completion_tokens = call_with_rate_limit(lambda: _completion(messages, api, model, temperature, max_tokens, on_chunk, response_format, call_timeout()), api, model, messages, max_tokens, nothing_streamed)
+    cache.set(cache_key, result, prompt_tokens, completion_tokens)
     return result, prompt_tokens, completion_tokens
 
+async def aget_completion(messages, api="openai", model="gpt-4o-mini", temperature=0.7, max_tokens=1000, on_chunk=None, response_format=None):
+    # Async counterpart of get_completion, returns the same (result, prompt_tokens, completion_tokens) tuple
+    raise_if_cancelled()
+    on_chunk, nothing_streamed = tracked_chunks(on_chunk)
+    on_chunk = cancellable_chunks(on_chunk)
+    cache = get_response_cache()
+    if cache is None:
+        return await acall_with_rate_limit(lambda: _acompletion(messages, api, model, temperature, max_tokens, on_chunk, response_format, call_timeout()), api, model, messages, max_tokens, nothing_streamed)
+
+    cache_key = make_cache_key(messages, api, model, temperature, max_tokens, response_format)
+    cached_result = cache.get(cache_key)
+    if cached_result is not None:
+        if on_chunk is not None:
+            on_chunk(cached_result)
+        return cached_result, 0, 0
+    result, prompt_tokens, completion_tokens = await acall_with_rate_limit(lambda: _acompletion(messages, api, model, temperature, max_tokens, on_chunk, response_format, call_timeout()), api, model, messages, max_tokens, nothing_streamed)
+    cache.set(cache_key, result, prompt_tokens, completion_tokens)
+    return result, prompt_tokens, completion_tokens
+
+def warmup(targets=None):
+    """
+    Pays cold-start costs ahead of the first request: imports the backends, opens pooled HTTPS connections,
+    refreshes Vertex AI credentials and loads Ollama models into memory. Failures are reported, not raised.
+
+    Parameters:
+        targets (list): (api, model) pairs to warm up. Defaults to DEFAULT_WARMUP_TARGETS.
+
+    Returns:
+        dict: "api:model" -> seconds spent, or the error message if warming up failed.
+    """
+    timings = {}
+    for api, model in targets or DEFAULT_WARMUP_TARGETS:
+        start_time = time.time()
+        try:
+            get_backend(api).warmup(model)
+            timings[f"{api}:{model}"] = time.time() - start_time
+            print(f"Warm-up {api}:{model} ===> DONE in {timings[f'{api}:{model}']:.4f} seconds")
+        except Exception as e:
+            timings[f"{api}:{model}"] = str(e)
+            print(f"Warm-up {api}:{model} ===> Error: {e}")
+    return timings
+
+def shutdown():
+    """
+    Closes the pooled connections of the backends used so far. Call at process shutdown.
+    """
+    if "openai" in _loaded_backends or "vertexai" in _loaded_backends:
+        from llm_clients import close_clients
+        close_clients()
+
+def _completion(messages, api, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    return get_backend(api).complete(messages, model, temperature, max_tokens, on_chunk, response_format, timeout)
+
+async def _acompletion(messages, api, model, temperature, max_tokens, on_chunk=None, response_format=None, timeout=None):
+    return await get_backend(api).acomplete(messages, model, temperature, max_tokens, on_chunk, response_format, timeout)
 
 # # TEST THE API
 # messages = [{"role": "user", "content": "What is the tallest mountain in the world?"}]
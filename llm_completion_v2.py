@@ -1,29 +1,32 @@
-from openai import OpenAI
 from langchain_ollama.llms import OllamaLLM
 from config import OPENAI_API_KEY
-import os
-from google.auth import default, transport
-import openai
+from llm_clients import get_openai_client
+from vertex_credentials import vertex_credentials, VERTEX_OPENAI_BASE_URL
+from rate_limiter import call_with_rate_limit
+
+def _chat_completion(client, **request):
+    response = client.chat.completions.create(**request)
+    return response.choices[0].message.content, response.usage.prompt_tokens, response.usage.completion_tokens
 
 def get_completion(messages, api="openai", model="gpt-4o-mini", json_format="", temperature=0.7, max_tokens=1000):
     # mode: gpt-4o-mini, gpt-4o, llama3.1, meta/llama3-405b-instruct-maas
+    # The pooled clients do not retry on their own; OpenAI and Vertex AI calls go through the shared rate limiter,
+    # which retries transient failures with backoff.
     prompt_tokens = 0
     completion_tokens = 0
     result = ""
     if api == "openai":
         try:
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            response = client.chat.completions.create(
+            client = get_openai_client("openai", OPENAI_API_KEY)
+            result, prompt_tokens, completion_tokens = call_with_rate_limit(lambda: _chat_completion(
+                client,
                 model=model,
                 messages=messages,
                 temperature=float(temperature),
                 max_tokens=max_tokens,
                 response_format=json_format,
                 #strict=True
-            )
-            result = response.choices[0].message.content
-            prompt_tokens= response.usage.prompt_tokens
-            completion_tokens = response.usage.completion_tokens
+            ), api, model, messages, max_tokens)
         except Exception as e:
             print(e) # Handle validation errors
             
@@ -36,45 +39,21 @@ def get_completion(messages, api="openai", model="gpt-4o-mini", json_format="",
         )
         result = ollama_llm.invoke(messages)
     elif api == "vertexai":
-        # Set environment variable for Google Application Credentials
-        SERVICE_ACCOUNT_PATH = r"D:\keys\focal-healer-431902-q6-19dcf02385ff.json"
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = SERVICE_ACCOUNT_PATH
-
-        PROJECT_ID = "focal-healer-431902-q6"
-        LOCATION = "us-central1"
-        BUCKET_NAME = "mybucket"
-        BUCKET_URI = f"gs://{BUCKET_NAME}"
-
-        # Initialize Vertex AI SDK for Python
-        import vertexai
-        vertexai.init(project=PROJECT_ID, location=LOCATION, staging_bucket=BUCKET_URI)
-
-        # Authentication
-        credentials, project = default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        auth_request = transport.requests.Request()
-        credentials.refresh(auth_request)
-
-        # Configure the OpenAI SDK to point to the Llama 3.1 Chat Completions API endpoint
-        MODEL_LOCATION = "us-central1"
-        client = openai.OpenAI(
-            base_url=f"https://{MODEL_LOCATION}-aiplatform.googleapis.com/v1beta1/projects/{PROJECT_ID}/locations/{MODEL_LOCATION}/endpoints/openapi/chat/completions?",
-            api_key=credentials.token,
-        )
+        # SDK init and access token are cached per process; the token is refreshed only near expiry
+        client = get_openai_client("vertexai", vertex_credentials.get_token(), base_url=VERTEX_OPENAI_BASE_URL)
 
         # Configure Llama 3.1 
         #MODEL_ID = "meta/llama3-405b-instruct-maas"
 
         # Chat
-        response = client.chat.completions.create(
+        result, prompt_tokens, completion_tokens = call_with_rate_limit(lambda: _chat_completion(
+            client,
             model=model,
             messages=messages,
             temperature=temperature,
             max_tokens=max_tokens,
-        )
-        result = response.choices[0].message.content
+        ), api, model, messages, max_tokens)
         result = result.replace("\n", "")
-        prompt_tokens= response.usage.prompt_tokens
-        completion_tokens = response.usage.completion_tokens
     else:
         raise ValueError("Unsupported API specified. Choose 'openai' or 'ollama'.")
     
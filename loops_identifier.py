@@ -2,15 +2,21 @@
 #%%
 # STEP 5 - LOOPS/CYCLES IDENTIFICATION
 import json
-from llm_completion import get_completion
+from typing import List
+from pydantic import BaseModel, Field
+from structured_output import StepOutput, structured_completion, astructured_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description", "ModelName", "Context", "Participants", "StartEvent", "EndEvent", "ActivitiesEvents", "ActionFlows", "Gateways"]
+# Fields sent as names/ids only (see process_model.FIELD_SUMMARIES)
+SUMMARY_FIELDS = ["Participants", "ActivitiesEvents"]
 SYSTEM_MESSAGE_TEMPLATE = """
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
 Task:
-Understand the textual description, identify context, and overall process goal of textual descriptions of BPMN process models within the delimiters {delimiter}. Output a Python list of JSON objects with keys: Loop. Ensure the output is strictly in JSON format without any additional text.
+Understand the textual description, identify context, and overall process goal of textual descriptions of BPMN process models within the delimiters {delimiter}. Output a Python list of JSON objects with keys: Loops.
 
 Instructions:
 - Read Thoroughly: Carefully read the textual description of the business process to grasp the overall objective, scope, and details. Try to identify loops.
@@ -25,7 +31,6 @@ Instructions:
 - Examine Feedback Mechanisms: Check for feedback loops where the output or result of a process step is evaluated, and based on the evaluation, the process may loop back to an earlier step for rework or further action.
 - Identify Loop Control Conditions: Understand the conditions under which the loop continues and the conditions under which the loop terminates. This helps to accurately model the loop in BPMN.
     - Textual Clues: Conditions or criteria for repetition, such as "until approved", "while not complete", or "as long as".
-- DO NOT output additional text except the JSON format. Do not output ```json or ```. Do not output comment "//"
 
 
 
@@ -38,21 +43,10 @@ The employee onboarding process begins when a new hire submits their completed p
     {
         "ModelName": "Onboarding process",
         "Context": "Human Resources",
-        "Scope": "Starts with the submission of completed paperwork by the new hire and ends with the assignment of the new hire to their department.",
-        "Objectives": "To ensure new hires complete all necessary paperwork, attend orientation, and are successfully integrated into their departments.",
-        "Participants": [
-            {"HR_Department": "Responsible for reviewing documents, scheduling orientation, and assigning new hire to the department"},
-            {"New_Hire": "Responsible for submitting paperwork and attending orientation"}
-        ],
+        "Participants": ["HR_Department", "New_Hire"],
         "StartEvent": "Start_SubmitPaperwork",
         "EndEvent": "End_AssignDepartment",
-        "ActivitiesEvents": [
-            {"A_ReviewDocuments": "The HR department reviews the submitted documents"},
-            {"A_ReturnForCorrection": "If any documents are missing or incorrect, they are returned to the new hire for correction"},
-            {"A_ScheduleOrientation": "Once the documents are in order, the new hire is scheduled for orientation"},
-            {"E_AttendOrientation": "After attending the orientation"},
-            {"A_AssignToDepartment": "the new hire is assigned to their department"}
-        ],
+        "ActivitiesEvents": ["A_ReviewDocuments", "A_ReturnForCorrection", "A_ScheduleOrientation", "E_AttendOrientation", "A_AssignToDepartment"],
         "ActionFlows": [
             {"from": "Start_SubmitPaperwork", "to": "A_ReviewDocuments"},
             {"from": "A_ReviewDocuments", "to": "A_ReturnForCorrection"},
@@ -136,6 +130,30 @@ Output:
 """
 
 
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class Loop(BaseModel):
+    LoopID: str
+    LoopDescription: str
+    Conditions: str
+    GatewaysForLoopEntries: List[str] = Field(description="Names of the gateways entering the loop")
+    GatewaysForLoopExits: List[str] = Field(description="Names of the gateways leaving the loop")
+    ActivitiesInLoop: List[str]
+
+    def to_output(self):
+        output = self.model_dump()
+        # The prompt examples number the entry and exit gateways: [{"LoopExit1": "XOR_..."}]
+        output["GatewaysForLoopEntries"] = [{f"LoopEntry{index}": name} for index, name in enumerate(self.GatewaysForLoopEntries, start=1)]
+        output["GatewaysForLoopExits"] = [{f"LoopExit{index}": name} for index, name in enumerate(self.GatewaysForLoopExits, start=1)]
+        return output
+
+class LoopsOutput(StepOutput):
+    Loops: List[Loop]
+
+    def to_output(self):
+        return {"Loops": [loop.to_output() for loop in self.Loops]}
+
+OUTPUT_SCHEMA = LoopsOutput
+
 def construct_user_message(text):
     """
     Constructs the user message by wrapping the text with delimiters.
@@ -164,26 +182,45 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
-    Identifies loops in a business process description.
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified loops.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies loops in a business process description.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified loops.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
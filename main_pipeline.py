@@ -1,61 +1,29 @@
 #%%
 # MAIN PIPELINE FOR BUSINESS PROCESS GENERATION FROM TEXT
+import copy
 import json
 import time
-from input_preprocess import identify_from_message as preprocess_identify_from_message
-from context_understanding import identify_from_message as context_identify_from_message
-from actions_identifier import identify_from_message as actions_identify_from_message
-from actionInstances_identifier import identify_from_message as actionInstances_identify_from_message # Action Instance
-from gateways_identifier import identify_from_message as gateways_identify_from_message
-from loops_identifier import identify_from_message as loops_identify_from_message
-from sequenceFlows_identifier import identify_from_message as sequenceFlow_identify_from_message
+import input_preprocess
+import context_understanding
+import actions_identifier
+import actionInstances_identifier # Action Instance
+import gateways_identifier
+import loops_identifier
+import sequenceFlows_identifier
+import fused_identifier # All elements in one call for short descriptions
+from cancellation import CancellationToken
+from step_graph import (
+    PipelineStep, StepFailed, run_step_graph, arun_step_graph,
+    DESCRIPTION, CONTEXT_FIELDS, ACTIVITY_FIELDS, ACTION_FLOW_FIELDS, GATEWAY_FIELDS, LOOP_FIELDS, SEQUENCE_FLOW_FIELDS,
+)
+from step_gating import preprocess_gate, gateways_gate, loops_gate
+from model_validation import (
+    validate_model, check_description_output, check_context_output, check_activities_output, check_action_flows_output,
+    check_gateways_output, check_loops_output, check_sequence_flows_output,
+)
 #from bp_logic_visualizer import identify_from_message as bpm_visualization_from_message
 from bp_logic_visualizer import visualize_bpmn, generate_dot_from_sequence
 
-import json
-
-def combine_results(previous_result, current_result, input_text=""):
-    """
-    Combines the results from two steps, including the input text and JSON format for each step.
-    Parameters:
-        previous_result (str): JSON string from the previous step.
-        current_result (str): JSON string from the current step.
-        input_text (str): The input text used for the current step.
-    Returns:
-        str: Combined string containing input text and combined JSON data.
-    """
-    if previous_result:
-        previous_json_data = json.loads(previous_result)
-        if isinstance(previous_json_data, list):
-            previous_json_data = previous_json_data[0]
-    else:
-        previous_json_data = {}
-
-    try:
-        current_json_data = json.loads(current_result)
-    except json.JSONDecodeError:
-        print("Error: current_result is not a valid JSON.")
-        print("current_result:", current_result)
-        return "Error: current_result is not a valid JSON."
-
-    # Combine both JSON results
-    if isinstance(previous_json_data, list):
-        previous_json_data = previous_json_data[0]
-    if isinstance(current_json_data, list):
-        current_json_data = current_json_data[0]
-
-    # Combine both JSON results
-    combined_json_data = previous_json_data
-    combined_json_data.update(current_json_data)
-
-    # Create the final combined result string
-    if input_text != "":
-        final_result = input_text + "\n" + json.dumps(combined_json_data, indent=4)
-    else:
-        final_result = json.dumps(combined_json_data, indent=4)
-
-    return final_result
-
 def calculate_cost(prompt_tokens, completion_tokens, price_per_1m_prompt_tokens, price_per_1m_completion_tokens):
     """
     Calculate the cost for given prompt and completion tokens based on the pricing per 1 million tokens.
@@ -84,114 +52,230 @@ def update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, t
     total_completion_tokens += completion_tokens
     return total_prompt_tokens, total_completion_tokens
 
-def pipeline(process_description):
+# Pipeline steps with the model fields each one writes, run in this order. Each step module declares the fields
+# its prompt reads (INPUT_FIELDS) and only receives those. Every step reads the output of the step before it, so
+# there is no work to overlap within one description.
+# Steps with a gate are skipped for documents where a local check shows they cannot change the model.
+# Steps with a cascade run through CASCADE_TIERS: the cheap tiers first, escalating to ESCALATION_TIER only when
+# their output fails the step's check (see model_cascade). With the cascade disabled every step runs on its own
+# model, the one the step used before the cascade existed.
+# Alternative backends: api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0 or api="ollama", model="phi3"
+# A local model can lead the cascade, e.g. CHEAP_TIERS = [("ollama", "llama3.1"), ("openai", "gpt-4o-mini")]
+CHEAP_TIERS = [("openai", "gpt-4o-mini")]
+ESCALATION_TIER = ("openai", "gpt-4o")
+CASCADE_TIERS = CHEAP_TIERS + [ESCALATION_TIER]
+
+PIPELINE_STEPS = [
+    # Step 1: Preprocessing to improve the textual description
+    PipelineStep("preprocess", "Step 1: Preprocessing to improve the textual description", input_preprocess,
+                 writes=[DESCRIPTION], model="gpt-4o", output_format="text", gate=preprocess_gate,
+                 cascade=CASCADE_TIERS, check=check_description_output),
+    # Step 2: Context understanding to identify context and objectives
+    PipelineStep("context", "Step 2: Context understanding to identify context and objectives", context_understanding,
+                 writes=CONTEXT_FIELDS, model="gpt-4o-mini", cascade=CASCADE_TIERS, check=check_context_output),
+    # Step 3: Identifying actions
+    PipelineStep("actions", "Step 3: Identifying actions", actions_identifier,
+                 writes=ACTIVITY_FIELDS, model="gpt-4o-mini", cascade=CASCADE_TIERS, check=check_activities_output),
+    # Step 3-1: Identifying Action Instance (Ordering relation between activities and events)
+    PipelineStep("action_instances", "Step 3-1: Identifying action instances", actionInstances_identifier,
+                 writes=ACTION_FLOW_FIELDS, model="gpt-4o-mini", cascade=CASCADE_TIERS, check=check_action_flows_output),
+    # Step 4: Identifying gateways
+    PipelineStep("gateways", "Step 4: Identifying gateways", gateways_identifier,
+                 writes=GATEWAY_FIELDS, gate=gateways_gate, model="gpt-4o-mini", cascade=CASCADE_TIERS, check=check_gateways_output),
+    # Step 5: Identifying loops
+    PipelineStep("loops", "Step 5: Identifying loops", loops_identifier,
+                 writes=LOOP_FIELDS, gate=loops_gate, model="gpt-4o-mini", cascade=CASCADE_TIERS, check=check_loops_output),
+    # Step 6: Identifying sequence flows
+    PipelineStep("sequence_flows", "Step 6: Identifying sequence flows", sequenceFlows_identifier,
+                 writes=SEQUENCE_FLOW_FIELDS, model="gpt-4o-mini", cascade=CASCADE_TIERS, check=check_sequence_flows_output),
+]
+
+# Fused extraction: one request returning all model elements, used for short descriptions. Its result only replaces
+# the staged pipeline when it passes local validation. It runs at temperature 0 so the same description gives the
+# same model JSON.
+FUSED_STEP = PipelineStep("fused", "Fused extraction of the complete process model", fused_identifier,
+                          writes=CONTEXT_FIELDS + ACTIVITY_FIELDS + ACTION_FLOW_FIELDS + GATEWAY_FIELDS + LOOP_FIELDS + SEQUENCE_FLOW_FIELDS,
+                          temperature=0.0)
+
+# Price in USD per 1M prompt and completion tokens
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.150, 0.600),
+}
+
+def print_step_result(step, record):
+    if record["skipped"]:
+        print(f"{step.title} ===> SKIPPED ({record['skipped']}) \n")
+    else:
+        print(f"{step.title} ===> {'RESTORED' if record['restored'] else 'DONE'} \n")
+    for attempt in record["attempts"][:-1]:
+        print(f"Escalated from {attempt['api']}:{attempt['model']}: {'; '.join(attempt['problems'])}")
+    print(record["result"])
+
+def records_cost(records, steps=PIPELINE_STEPS + [FUSED_STEP]):
+    """
+    Calculates the cost of a pipeline run from the token usage of every step and the price of its model.
+    Steps that ran through a cascade are priced per tier called.
+
+    Parameters:
+        records (dict): Step name -> step record, as returned by run_pipeline.
+        steps (list): The pipeline steps.
+
+    Returns:
+        dict: A dictionary containing the cost for prompt tokens, completion tokens, and total cost
+    """
+    costs = {"cost_prompt_tokens": 0.0, "cost_completion_tokens": 0.0, "total_cost": 0.0}
+    for step in steps:
+        if step.name not in records:
+            continue
+        record = records[step.name]
+        usage = record["attempts"] or [{"model": step.model, "prompt_tokens": record["prompt_tokens"], "completion_tokens": record["completion_tokens"]}]
+        for attempt in usage:
+            price_per_1m_prompt_tokens, price_per_1m_completion_tokens = MODEL_PRICES.get(attempt["model"], (0.0, 0.0))
+            step_costs = calculate_cost(attempt["prompt_tokens"], attempt["completion_tokens"], price_per_1m_prompt_tokens, price_per_1m_completion_tokens)
+            for key in costs:
+                costs[key] += step_costs[key]
+    return costs
+
+def sequence_flow_result(model, records):
+    """
+    Returns:
+        str: The raw output of the sequence flow step, or the fused result's sequence flows in the same format.
+    """
+    if "sequence_flows" in records:
+        return records["sequence_flows"]["result"]
+    return json.dumps([{"SequenceFlows": model.sequence_flows}], indent=4)
+
+def deterministic_preprocess(steps):
+    """
+    Returns:
+        list: The steps with the preprocessing step replaced by a copy that runs at temperature 0.
+    """
+    deterministic = []
+    for step in steps:
+        if step.name == "preprocess":
+            step = copy.copy(step)
+            step.temperature = 0.0
+        deterministic.append(step)
+    return deterministic
+
+def check_fused_result(model, records):
+    """
+    Validates a fused extraction. Returns the model when it passed, otherwise None (the problems are printed and
+    kept in the fused record).
+    """
+    problems = validate_model(model)
+    records[FUSED_STEP.name]["problems"] = problems
+    if problems:
+        print(f"{FUSED_STEP.title} ===> INVALID, running the staged pipeline")
+        for problem in problems:
+            print(f" - {problem}")
+        return None
+    return model
+
+def run_fused(process_description, on_chunk=None, on_step_done=print_step_result, previous_records=None, cancel_token=None):
+    """
+    Runs the fused extraction over a description.
+
+    Returns:
+        tuple: The validated ProcessModel (None when the result is invalid) and the fused step record.
+    """
+    try:
+        model, records = run_step_graph([FUSED_STEP], process_description, on_chunk=on_chunk, on_step_done=on_step_done, previous_records=previous_records, cancel_token=cancel_token)
+    except ValueError as e:
+        print(f"{FUSED_STEP.title} ===> INVALID JSON, running the staged pipeline")
+        # The failed call's tokens still count towards the run
+        return None, {FUSED_STEP.name: e.record} if isinstance(e, StepFailed) else {}
+    return check_fused_result(model, records), records
+
+def run_pipeline(process_description, on_chunk=None, on_step_done=print_step_result, previous_records=None, fused=True, cancel_token=None, steps=PIPELINE_STEPS):
+    """
+    Runs the pipeline over one description and returns the process model and the raw step records.
+    Short descriptions are first tried with the fused extraction (FUSED_STEP); PIPELINE_STEPS run when it is
+    disabled, not applicable or fails validation.
+    Parameters:
+        process_description (str): The textual description of the business process.
+        on_chunk (callable): Optional callback receiving each streamed text delta of every step as it arrives.
+        on_step_done (callable): Optional callback on_step_done(step, record) invoked as each step finishes.
+        previous_records (dict): Records of an earlier run; steps whose input is unchanged are not re-run.
+        fused (bool): Whether short descriptions are tried with the fused extraction first.
+        cancel_token (CancellationToken): Optional deadline and cancellation flag of the run; once it is cancelled
+            or expired no further steps start and PipelineCancelled is raised (see cancellation).
+        steps (list): The staged pipeline steps, PIPELINE_STEPS by default.
+    Returns:
+        tuple: The ProcessModel and a dict of step name -> record with input, result, output, prompt_tokens,
+        completion_tokens and duration.
+    """
+    fused_records = {}
+    if fused and fused_identifier.is_short_description(process_description):
+        model, fused_records = run_fused(process_description, on_chunk, on_step_done, previous_records, cancel_token)
+        if model is not None:
+            return model, fused_records
+    model, records = run_step_graph(steps, process_description, on_chunk=on_chunk, on_step_done=on_step_done, previous_records=previous_records, cancel_token=cancel_token)
+    records.update(fused_records) # A rejected fused attempt still counts towards tokens and cost
+    return model, records
+
+class IncrementalPipeline:
+    """
+    Pipeline that remembers the step records of its last run. When the description is edited, run() only
+    re-runs the steps whose input changed and the dependents whose input changes in turn.
+
+    Every step reads the preprocessed description, so an edit that changes the rewritten description re-runs
+    every step that is not gated. Later steps are only reused when preprocessing rewrites the edited description
+    to the same text as before, which is why it runs at temperature 0 here (pipeline() keeps the step's own
+    temperature).
+    """
+
+    def __init__(self):
+        self.records = None
+        self.steps = deterministic_preprocess(PIPELINE_STEPS)
+
+    def run(self, process_description, on_chunk=None, on_step_done=print_step_result, cancel_token=None):
+        """
+        Parameters:
+            process_description (str): The (edited) textual description of the business process.
+            on_chunk (callable): Optional callback receiving each streamed text delta.
+            on_step_done (callable): Optional callback on_step_done(step, record) invoked as each step finishes.
+            cancel_token (CancellationToken): Optional deadline and cancellation flag of the run.
+        Returns:
+            tuple: The combined JSON result and the sequence flow result.
+        """
+        model, records = run_pipeline(process_description, on_chunk=on_chunk, on_step_done=on_step_done, previous_records=self.records, cancel_token=cancel_token, steps=self.steps)
+        rerun = [name for name, record in records.items() if not record["restored"] and not record["skipped"]]
+        print(f"Re-ran {len(rerun)} of {len(records)} steps: {', '.join(rerun)}")
+        self.records = records
+        return model.to_json(), sequence_flow_result(model, records)
+
+def pipeline(process_description, on_chunk=None, timeout=None, cancel_token=None):
     """
     Processes the input text through a pipeline of identifying business process models from text.
+    The steps run one after another (see PIPELINE_STEPS); short descriptions are first tried in
+    one fused call (see run_pipeline).
     Parameters:
         text (str): The textual description of the business process.
+        on_chunk (callable): Optional callback receiving each streamed text delta of every step as it arrives.
+        timeout (float): Optional time budget of the run in seconds; LLM calls time out with the time left and
+            no further steps start once it is used up.
+        cancel_token (CancellationToken): Optional token to cancel the run from another thread; takes the place
+            of timeout.
     Returns:
         str: The combined output from all steps.
+    Raises:
+        PipelineCancelled: If the run is cancelled or exceeds its time budget (DeadlineExceeded).
     """
     total_start_time = time.time()
     total_prompt_tokens = 0
     total_completion_tokens = 0
-    delay_time = 0
 
-    previous_json_result=""
-
-    # Step 1: Preprocessing to improve the textual description
-    print("Step 1: Preprocessing to improve the textual description", end=' ', flush=True)
-    #preprocess_result, prompt_tokens, completion_tokens = preprocess_identify_from_message(process_description, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0)
-    
-    preprocess_result, prompt_tokens, completion_tokens = preprocess_identify_from_message(process_description, api="openai", model="gpt-4o", temperature=0.7)
-    # total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    # new_process_description = json.loads(preprocess_result)[0]["Original"] #Original or Augmented
-    #new_process_description = process_description
-    new_process_description = preprocess_result
-    
-    #print(preprocess_result)
-    print(" ===> DONE \n")
-    print(new_process_description)
-    time.sleep(delay_time) # For vertex AI Llama3.1 405b
-    
-    # Step 2: Context understanding to identify context and objectives
-    print("Step 2: Context understanding to identify context and objectives", end=' ', flush=True)
-    #context_json_result, prompt_tokens, completion_tokens = context_identify_from_message(new_process_description, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0)
-    #context_json_result, prompt_tokens, completion_tokens = context_identify_from_message(new_process_description, api="ollama", model="phi3", temperature=0.7)
-    context_json_result, prompt_tokens, completion_tokens = context_identify_from_message(new_process_description, api="openai", model="gpt-4o-mini", temperature=0.7)
-    total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    previous_json_result = context_json_result
-    combined_prompt = combine_results("", context_json_result, new_process_description)
-    print(" ===> DONE \n")
-    print(previous_json_result)
-    #print(combined_prompt)
-    time.sleep(delay_time) # For vertex AI Llama3.1 405b
-    
-    # Step 3: Identifying actions
-    print("Step 3: Identifying actions", end=' ', flush=True) 
-    #actions_json_result, prompt_tokens, completion_tokens = actions_identify_from_message(combined_prompt, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0)
-    #actions_json_result, prompt_tokens, completion_tokens = actions_identify_from_message(combined_prompt, api="ollama", model="phi3", temperature=0.0)
-    actions_json_result, prompt_tokens, completion_tokens = actions_identify_from_message(combined_prompt, api="openai", model="gpt-4o-mini", temperature=0.7)
-    total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    previous_json_result = combine_results(previous_json_result, actions_json_result)
-    combined_prompt = combine_results(previous_json_result, actions_json_result, new_process_description)
-    print(" ===> DONE \n")
-    print(actions_json_result)
-    #print(combined_prompt)
-    time.sleep(delay_time) # For vertex AI Llama3.1 405b
-
-    # Step 3-1: Identifying Action Instance (Ordering relation between activities and events) actionInstance_identify_from_message
-    print("Step 3-1: Identifying action instances", end=' ', flush=True) 
-    #actionsInstance_json_result, prompt_tokens, completion_tokens = actions_identify_from_message(combined_prompt, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0)
-    #actions_json_result, prompt_tokens, completion_tokens = actions_identify_from_message(combined_prompt, api="ollama", model="phi3", temperature=0.0)
-    actionsInstances_json_result, prompt_tokens, completion_tokens = actionInstances_identify_from_message(combined_prompt, api="openai", model="gpt-4o-mini", temperature=0.7)
-    total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    previous_json_result = combine_results(previous_json_result, actionsInstances_json_result)
-    combined_prompt = combine_results(previous_json_result, actionsInstances_json_result, new_process_description)
-    print(" ===> DONE \n")
-    print(actionsInstances_json_result)
-    #print(combined_prompt)
-    time.sleep(delay_time) # For vertex AI Llama3.1 405b
-    
-    # Step 4: Identifying gateways
-    print("Step 4: Identifying gateways", end=' ', flush=True)
-    #gateways_json_result, prompt_tokens, completion_tokens = gateways_identify_from_message(combined_prompt, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0)
-    #gateways_json_result, prompt_tokens, completion_tokens = gateways_identify_from_message(combined_prompt, api="ollama", model="phi3", temperature=0.0)
-    gateways_json_result, prompt_tokens, completion_tokens = gateways_identify_from_message(combined_prompt, api="openai", model="gpt-4o-mini", temperature=0.7)
-    total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    previous_json_result = combine_results(previous_json_result, gateways_json_result)
-    combined_prompt = combine_results(previous_json_result, gateways_json_result, new_process_description)
-    print(" ===> DONE \n") 
-    print(gateways_json_result)
-    
-    #print(gateways_json_result)
-    #print(combined_prompt)
-    time.sleep(delay_time) # For vertex AI Llama3.1 405b
-    
-    # Step 5: Identifying loops
-    print("Step 5: Identifying loops", end=' ', flush=True)
-    #loops_json_result, prompt_tokens, completion_tokens = loops_identify_from_message(combined_prompt, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.0)
-    #loops_json_result, prompt_tokens, completion_tokens = loops_identify_from_message(combined_prompt, api="ollama", model="phi3", temperature=0.0)
-    loops_json_result, prompt_tokens, completion_tokens = loops_identify_from_message(combined_prompt, api="openai", model="gpt-4o-mini", temperature=0.7)
-    total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    previous_json_result = combine_results(previous_json_result, loops_json_result)
-    combined_prompt = combine_results(previous_json_result, loops_json_result, new_process_description)
-    print(" ===> DONE \n")
-    print(loops_json_result)
-    #print(combined_prompt)
-    time.sleep(delay_time) # For vertex AI Llama3.1 405b
-    
-    # Step 6: Identifying sequence flows
-    print("Step 6: Identifying sequence flows", end=' ', flush=True)
-    #sequence_flow_result, prompt_tokens, completion_tokens = sequenceFlow_identify_from_message(combined_prompt, api="vertexai", model="meta/llama3-405b-instruct-maas", temperature=0.7)
-    #sequence_flow_result, prompt_tokens, completion_tokens = sequenceFlow_identify_from_message(combined_prompt, api="ollama", model="phi3", temperature=0.7)
-    sequence_flow_result, prompt_tokens, completion_tokens = sequenceFlow_identify_from_message(combined_prompt, api="openai", model="gpt-4o-mini", temperature=0.7)
-    total_prompt_tokens, total_completion_tokens = update_total_tokens(prompt_tokens, completion_tokens, total_prompt_tokens, total_completion_tokens)
-    previous_json_result = combine_results(previous_json_result, sequence_flow_result)
-    combined_prompt = combine_results(previous_json_result, sequence_flow_result, new_process_description)
-    print(" ===> DONE \n")
-    print(sequence_flow_result)
-    #print(combined_prompt)
+    if cancel_token is None and timeout is not None:
+        cancel_token = CancellationToken(timeout)
+    model, records = run_pipeline(process_description, on_chunk=on_chunk, cancel_token=cancel_token)
+    for name, record in records.items():
+        if name == "preprocess":
+            continue # Preprocessing tokens are not part of the cost below
+        total_prompt_tokens, total_completion_tokens = update_total_tokens(record["prompt_tokens"], record["completion_tokens"], total_prompt_tokens, total_completion_tokens)
+    previous_json_result = model.to_json()
+    sequence_flows = sequence_flow_result(model, records)
 
     # Step 7: Visualize Business Process with Graphviz
     #print("Step 7: Visualize Business Process with Graphviz")
@@ -214,18 +298,39 @@ def pipeline(process_description):
     # print(f"Total Prompt Tokens: {total_prompt_tokens}")
     # print(f"Total Completion Tokens: {total_completion_tokens} \n")
 
-    # Constants
-    PROMPT_TOKENS = total_prompt_tokens
-    COMPLETION_TOKENS = total_completion_tokens
-    PRICE_PER_1M_PROMPT_TOKENS = 0.150  # USD
-    PRICE_PER_1M_COMPLETION_TOKENS = 0.600  # USD
-    costs = calculate_cost(PROMPT_TOKENS, COMPLETION_TOKENS, PRICE_PER_1M_PROMPT_TOKENS, PRICE_PER_1M_COMPLETION_TOKENS)
+    # Escalated steps are priced at the model they escalated to
+    costs = records_cost(records, [step for step in PIPELINE_STEPS + [FUSED_STEP] if step.name != "preprocess"])
     # Output the results
     print(f"Cost for {total_prompt_tokens} Prompt Tokens: ${costs['cost_prompt_tokens']:.8f}")
     print(f"Cost for {total_completion_tokens} Completion Tokens: ${costs['cost_completion_tokens']:.8f}")
     print(f"Total Cost for {total_tokens} Tokens: ${costs['total_cost']:.8f}")
     
-    return previous_json_result, sequence_flow_result
+    return previous_json_result, sequence_flows
+
+async def apipeline(process_description, fused=True, timeout=None, cancel_token=None):
+    """
+    Async variant of pipeline. Runs the same steps without blocking the event loop, so many
+    descriptions can be processed concurrently, e.g. with asyncio.gather(*[apipeline(d) for d in descriptions]).
+    Parameters:
+        process_description (str): The textual description of the business process.
+        timeout (float): Optional time budget of the run in seconds.
+        cancel_token (CancellationToken): Optional token to cancel the run; takes the place of timeout.
+    Returns:
+        tuple: The combined JSON result and the sequence flow result.
+    """
+    if cancel_token is None and timeout is not None:
+        cancel_token = CancellationToken(timeout)
+    fused_model = None
+    if fused and fused_identifier.is_short_description(process_description):
+        try:
+            fused_model, fused_records = await arun_step_graph([FUSED_STEP], process_description, cancel_token=cancel_token)
+            fused_model = check_fused_result(fused_model, fused_records)
+        except ValueError:
+            print(f"{FUSED_STEP.title} ===> INVALID JSON, running the staged pipeline")
+    if fused_model is not None:
+        return fused_model.to_json(), sequence_flow_result(fused_model, fused_records)
+    model, records = await arun_step_graph(PIPELINE_STEPS, process_description, cancel_token=cancel_token)
+    return model.to_json(), sequence_flow_result(model, records)
 
 # Example usage
 if __name__ == "__main__":
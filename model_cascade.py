@@ -0,0 +1,66 @@
+#%%
+# MODEL CASCADE
+# A step with a cascade first runs on cheap or fast models and only escalates to the stronger model ending its
+# cascade when the local check of its output fails (see model_validation). With the cascade disabled the step runs
+# on its own model alone. Every tier that was called is kept in the step
+# record's "attempts", so escalation rates can be tracked per step and the policy tuned.
+
+_cascade_enabled = True
+
+def enable_model_cascade():
+    global _cascade_enabled
+    _cascade_enabled = True
+
+def disable_model_cascade():
+    """
+    Runs every step on its own model only, e.g. to compare the quality of the cascade against it.
+    """
+    global _cascade_enabled
+    _cascade_enabled = False
+
+def is_model_cascade_enabled():
+    return _cascade_enabled
+
+def step_tiers(step):
+    """
+    Returns:
+        list: The (api, model) pairs tried for the step in order: its cascade, or its own api and model when it
+        has none or the cascade is disabled.
+    """
+    if not step.cascade or step.check is None or not _cascade_enabled:
+        return [(step.api, step.model)]
+    return list(step.cascade)
+
+def make_attempt(api, model, prompt_tokens, completion_tokens, problems):
+    return {"api": api, "model": model, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "problems": problems}
+
+def attempted_models(records):
+    """
+    Returns:
+        dict: Step name -> the "api:model" tiers called for it, for every step of a run that was called.
+    """
+    return {
+        name: [f"{attempt['api']}:{attempt['model']}" for attempt in record["attempts"]]
+        for name, record in records.items() if record["attempts"]
+    }
+
+def escalation_rates(runs):
+    """
+    Aggregates the escalations of many runs.
+
+    Parameters:
+        runs (iterable): attempted_models() of every run.
+
+    Returns:
+        dict: Step name -> {"runs", "escalated", "rate", "accepted": {"api:model": count}}.
+    """
+    rates = {}
+    for run in runs:
+        for name, models in run.items():
+            stats = rates.setdefault(name, {"runs": 0, "escalated": 0, "rate": 0.0, "accepted": {}})
+            stats["runs"] += 1
+            stats["escalated"] += len(models) > 1
+            stats["accepted"][models[-1]] = stats["accepted"].get(models[-1], 0) + 1
+    for stats in rates.values():
+        stats["rate"] = stats["escalated"] / stats["runs"]
+    return rates
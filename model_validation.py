@@ -0,0 +1,197 @@
+#%%
+# LOCAL STRUCTURAL VALIDATION OF PROCESS MODELS
+# Checks a ProcessModel against the naming format and the BPMN rules the sequence flow prompt asks for, without
+# calling a model. Every check returns a list of problems; an empty list means the model passed.
+
+NODE_PREFIXES = ("Start_", "End_", "A_", "E_", "XOR_", "OR_", "AND_")
+GATEWAY_PREFIXES = ("XOR_", "OR_", "AND_")
+# Sections of the preprocessed description every process has (decision points are optional for linear processes)
+DESCRIPTION_SECTIONS = ["Process Name:", "Steps:"]
+
+def activity_ids(activities_events):
+    """
+    Returns:
+        list: The node ids of an ActivitiesEvents list ([{"A_Id": "explanation"}, ...] or plain ids).
+    """
+    ids = []
+    for activity in activities_events or []:
+        if isinstance(activity, dict):
+            # Entries may carry extra keys such as "Participant" next to the node id
+            ids.extend(key for key in activity if key.startswith(NODE_PREFIXES))
+        elif isinstance(activity, str):
+            ids.append(activity)
+    return ids
+
+def _flow_graph(flows):
+    successors = {}
+    predecessors = {}
+    for flow in flows:
+        successors.setdefault(flow["from"], set()).add(flow["to"])
+        predecessors.setdefault(flow["to"], set()).add(flow["from"])
+        successors.setdefault(flow["to"], set())
+        predecessors.setdefault(flow["from"], set())
+    return successors, predecessors
+
+def _reachable(starts, edges):
+    seen = set(starts)
+    stack = list(starts)
+    while stack:
+        for node in edges.get(stack.pop(), ()):
+            if node not in seen:
+                seen.add(node)
+                stack.append(node)
+    return seen
+
+def validate_flows(flows, key="SequenceFlows"):
+    """
+    Checks the shape of a flow list: every flow is a {"from": ..., "to": ...} object between correctly named nodes.
+    """
+    if not isinstance(flows, list) or not flows:
+        return [f"{key} is missing or empty"]
+    problems = []
+    for flow in flows:
+        if not isinstance(flow, dict) or not isinstance(flow.get("from"), str) or not isinstance(flow.get("to"), str):
+            problems.append(f"{key} entry is not a from/to object: {flow}")
+            continue
+        for node in (flow["from"], flow["to"]):
+            if not node.startswith(NODE_PREFIXES):
+                problems.append(f"{key} node {node} does not follow the naming format")
+    return problems
+
+def validate_sequence_flows(sequence_flows, activities_events=None):
+    """
+    Checks the sequence flows against the BPMN rules of the sequence flow prompt.
+
+    Parameters:
+        sequence_flows (list): The SequenceFlows of the model.
+        activities_events (list): The ActivitiesEvents of the model; when given, each of them must be connected.
+
+    Returns:
+        list: The problems found.
+    """
+    problems = validate_flows(sequence_flows)
+    if problems:
+        return problems
+
+    successors, predecessors = _flow_graph(sequence_flows)
+    start_nodes = [node for node in successors if node.startswith("Start_")]
+    end_nodes = [node for node in successors if node.startswith("End_")]
+    if not start_nodes:
+        problems.append("no start event")
+    if not end_nodes:
+        problems.append("no end event")
+    for node in start_nodes:
+        if predecessors[node]:
+            problems.append(f"start event {node} has incoming flows")
+    for node in end_nodes:
+        if successors[node]:
+            problems.append(f"end event {node} has outgoing flows")
+
+    for node in successors:
+        if node.startswith(GATEWAY_PREFIXES):
+            incoming, outgoing = len(predecessors[node]), len(successors[node])
+            if incoming <= 1 and outgoing <= 1:
+                problems.append(f"gateway {node} neither splits nor joins")
+            elif incoming > 1 and outgoing > 1:
+                problems.append(f"gateway {node} splits and joins at the same time")
+
+    # Dangling nodes: everything must lie on a path from a start event to an end event
+    if start_nodes and end_nodes:
+        from_start = _reachable(start_nodes, successors)
+        to_end = _reachable(end_nodes, predecessors)
+        for node in successors:
+            if node not in from_start:
+                problems.append(f"{node} is not reachable from a start event")
+            elif node not in to_end:
+                problems.append(f"{node} does not lead to an end event")
+
+    for node in activity_ids(activities_events):
+        if node not in successors:
+            problems.append(f"activity {node} is not connected")
+    return problems
+
+def validate_model(model):
+    """
+    Validates a complete process model.
+
+    Parameters:
+        model (ProcessModel): The process model.
+
+    Returns:
+        list: The problems found; empty when the model passed.
+    """
+    problems = []
+    if not activity_ids(model.activities_events):
+        problems.append("ActivitiesEvents is missing or empty")
+    if model.action_flows is not None:
+        problems.extend(validate_flows(model.action_flows, "ActionFlows"))
+    problems.extend(validate_sequence_flows(model.sequence_flows, model.activities_events))
+    return problems
+
+# Step output checks: check(output, model) validates one step's parsed output against the model built so far.
+# The model cascade escalates a step to a stronger model when its check reports problems.
+
+def check_description_output(output, model):
+    if not output.strip():
+        return ["description is empty"]
+    missing = [header for header in DESCRIPTION_SECTIONS if header not in output]
+    if missing:
+        return [f"description misses the sections {', '.join(missing)}"]
+    return []
+
+def check_context_output(output, model):
+    return [f"{key} is missing or empty" for key in ("ModelName", "Context", "Scope", "Objectives", "Participants") if not output.get(key)]
+
+def check_activities_output(output, model):
+    problems = []
+    if not str(output.get("StartEvent", "")).startswith("Start_"):
+        problems.append("StartEvent is missing or not named Start_<Name>")
+    if not str(output.get("EndEvent", "")).startswith("End_"):
+        problems.append("EndEvent is missing or not named End_<Name>")
+    if not activity_ids(output.get("ActivitiesEvents")):
+        problems.append("ActivitiesEvents is missing or empty")
+    return problems
+
+def check_action_flows_output(output, model):
+    flows = output.get("ActionFlows")
+    problems = validate_flows(flows, "ActionFlows")
+    if problems:
+        return problems
+    nodes = set(activity_ids(model.activities_events)) | {model.start_event, model.end_event}
+    connected = set()
+    for flow in flows:
+        connected.update((flow["from"], flow["to"]))
+    for node in sorted(connected - nodes):
+        problems.append(f"ActionFlows node {node} is not an identified activity or event")
+    for node in sorted(nodes - connected):
+        problems.append(f"{node} is not connected by the ActionFlows")
+    return problems
+
+def check_gateways_output(output, model):
+    gateways = output.get("Gateways")
+    if not isinstance(gateways, list):
+        return ["Gateways is missing"]
+    problems = []
+    for gateway in gateways:
+        name = gateway.get("name", "") if isinstance(gateway, dict) else ""
+        if not name.startswith(GATEWAY_PREFIXES):
+            problems.append(f"gateway {gateway} is not named XOR_, OR_ or AND_<Name>")
+    return problems
+
+def check_loops_output(output, model):
+    loops = output.get("Loops")
+    if not isinstance(loops, list):
+        return ["Loops is missing"]
+    nodes = set(activity_ids(model.activities_events))
+    problems = []
+    for loop in loops:
+        if not isinstance(loop, dict):
+            problems.append(f"loop {loop} is not an object")
+            continue
+        for node in loop.get("ActivitiesInLoop", []):
+            if node not in nodes:
+                problems.append(f"loop {loop.get('LoopID')} contains the unknown activity {node}")
+    return problems
+
+def check_sequence_flows_output(output, model):
+    return validate_sequence_flows(output.get("SequenceFlows"), model.activities_events)
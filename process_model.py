@@ -0,0 +1,122 @@
+#%%
+# IN-MEMORY PROCESS MODEL STATE
+# The process model accumulated by the pipeline steps. Each step's JSON output is parsed once and applied in
+# place; the model is serialized once per outgoing prompt, in compact form, instead of being re-parsed and
+# pretty-printed at every step.
+import json
+
+# JSON key -> attribute, in the order the fields appear in the combined result
+MODEL_FIELDS = [
+    ("ModelName", "model_name"),
+    ("Context", "context"),
+    ("Scope", "scope"),
+    ("Objectives", "objectives"),
+    ("Participants", "participants"),
+    ("StartEvent", "start_event"),
+    ("EndEvent", "end_event"),
+    ("ActivitiesEvents", "activities_events"),
+    ("ActionFlows", "action_flows"),
+    ("Gateways", "gateways"),
+    ("Loops", "loops"),
+    ("SequenceFlows", "sequence_flows"),
+]
+FIELD_ATTRIBUTES = dict(MODEL_FIELDS)
+
+# Separators without whitespace: the model is sent as prompt context, where indentation only costs tokens
+COMPACT_SEPARATORS = (",", ":")
+
+def participant_names(participants):
+    # [{"HR_Department": "Responsible for ..."}] -> ["HR_Department"]
+    return [name for entry in participants if isinstance(entry, dict) for name in entry]
+
+def activity_ids(activities_events):
+    # [{"A_ReviewDocuments": "The HR department reviews ...", "Participant": "HR_Department"}] -> ["A_ReviewDocuments"]
+    return [key for entry in activities_events if isinstance(entry, dict) for key in entry if key != "Participant"]
+
+# Short forms of fields whose full value only matters to some steps: a step listing a field in its SUMMARY_FIELDS
+# receives only the names or ids, since the description it also gets already holds the text
+FIELD_SUMMARIES = {
+    "Participants": participant_names,
+    "ActivitiesEvents": activity_ids,
+}
+
+class ProcessModel:
+    """
+    The business process model built up by the pipeline.
+
+    Attributes:
+        description (str): The (preprocessed) textual description of the business process.
+        model_name, context, scope, objectives (str): Context understanding.
+        participants (list): Participants and their responsibilities.
+        start_event, end_event (str): Start and end event ids.
+        activities_events (list): Activities and intermediate events.
+        action_flows (list): Ordering relations between activities and events.
+        gateways (list): Gateways with their conditions and branches.
+        loops (list): Loops with their entry and exit gateways.
+        sequence_flows (list): The final sequence flows.
+        extra (dict): Keys a step returned beyond the known fields, kept as they are.
+
+    Unset fields are None and are left out of every serialization.
+    """
+
+    def __init__(self, description=""):
+        self.description = description
+        for _, attribute in MODEL_FIELDS:
+            setattr(self, attribute, None)
+        self.extra = {}
+
+    def update(self, output):
+        """
+        Applies a step's parsed JSON output to the model.
+
+        Parameters:
+            output (dict): The step output, keyed like the combined result (e.g. "Gateways").
+        """
+        for key, value in output.items():
+            attribute = FIELD_ATTRIBUTES.get(key)
+            if attribute is None:
+                self.extra[key] = value
+            else:
+                setattr(self, attribute, value)
+
+    def to_dict(self, fields=None):
+        """
+        Parameters:
+            fields (iterable): Only include these JSON keys; all set fields when None.
+
+        Returns:
+            dict: The model keyed like the combined result.
+        """
+        fields = None if fields is None else set(fields)
+        data = {}
+        for key, attribute in MODEL_FIELDS:
+            value = getattr(self, attribute)
+            if value is not None and (fields is None or key in fields):
+                data[key] = value
+        for key, value in self.extra.items():
+            if fields is None or key in fields:
+                data[key] = value
+        return data
+
+    def to_prompt(self, fields=None, summary_fields=()):
+        """
+        Serializes the model for a step prompt: the description followed by the compact JSON of the given fields.
+
+        Parameters:
+            fields (iterable): Only include these JSON keys; all set fields when None.
+            summary_fields (iterable): Keys sent in their short form (see FIELD_SUMMARIES).
+        """
+        data = self.to_dict(fields)
+        for key in summary_fields:
+            if key in data and isinstance(data[key], list):
+                data[key] = FIELD_SUMMARIES[key](data[key])
+        if not data:
+            return self.description
+        return self.description + "\n" + json.dumps(data, ensure_ascii=False, separators=COMPACT_SEPARATORS)
+
+    def to_json(self):
+        """
+        Returns:
+            str: The combined result as indented JSON, for output files and the user.
+        """
+        return json.dumps(self.to_dict(), indent=4)
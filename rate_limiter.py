@@ -0,0 +1,252 @@
+#%%
+# SHARED RATE LIMITING AND RETRIES FOR LLM BACKENDS
+import email.utils
+import random
+import threading
+import time
+from cancellation import PipelineCancelled, raise_if_cancelled, sleep, asleep
+
+# Quotas per (api, model): requests per minute and tokens per minute. Models without an entry are not limited.
+RATE_LIMITS = {
+    ("openai", "gpt-4o"): {"rpm": 500, "tpm": 30_000},
+    ("openai", "gpt-4o-mini"): {"rpm": 500, "tpm": 200_000},
+    ("vertexai", "meta/llama3-405b-instruct-maas"): {"rpm": 60, "tpm": 60_000},
+}
+
+# Retry policy for rate limit, timeout and transient server errors
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0  # seconds
+MAX_BACKOFF = 60.0  # seconds
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout"}
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at capacity per minute. Callers reserve their amount up front and
+    sleep off any deficit, so concurrent callers are served in arrival order without busy waiting.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0  # units per second
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        """
+        Takes amount from the bucket and returns the seconds to wait until it is covered.
+        """
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        self.available -= amount
+        return max(0.0, -self.available / self.rate)
+
+    def refund(self, amount):
+        self.available = min(self.capacity, self.available + amount)
+
+class RateLimiter:
+    """
+    Budgets requests/minute and tokens/minute for one backend and model. Thread-safe and usable from asyncio.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(estimated_tokens, now))
+            return wait
+
+    def acquire(self, estimated_tokens):
+        """
+        Blocks until one request with the estimated number of tokens fits into the quota.
+
+        Parameters:
+            estimated_tokens (int): Prompt plus maximum completion tokens expected for the request.
+
+        Returns:
+            float: The seconds spent waiting.
+        """
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            try:
+                sleep(wait)
+            except PipelineCancelled:
+                self.record_usage(estimated_tokens, 0) # The request is not sent
+                raise
+        return wait
+
+    async def aacquire(self, estimated_tokens):
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            try:
+                await asleep(wait)
+            except PipelineCancelled:
+                self.record_usage(estimated_tokens, 0)
+                raise
+        return wait
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """
+        Corrects the token budget once the real usage of a request is known.
+        """
+        if self.tokens is not None:
+            with self._lock:
+                self.tokens.refund(estimated_tokens - actual_tokens)
+
+    def pause(self, seconds):
+        """
+        Holds back every caller of this limiter, e.g. after the server answered with Retry-After.
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(api, model):
+    """
+    Returns the process-wide limiter shared by all calls to the given backend and model.
+
+    Returns:
+        RateLimiter: The limiter, or None when no quota is configured for the model.
+    """
+    limits = RATE_LIMITS.get((api, model))
+    if limits is None:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get((api, model))
+        if limiter is None:
+            limiter = RateLimiter(limits.get("rpm"), limits.get("tpm"))
+            _limiters[(api, model)] = limiter
+    return limiter
+
+def estimate_tokens(messages, max_tokens):
+    """
+    Cheap upper estimate of the tokens a request consumes (about four characters per prompt token).
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+def is_retryable(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+def retry_after_seconds(error):
+    """
+    Reads the server-requested delay from Retry-After (seconds or HTTP date) or retry-after-ms headers.
+
+    Returns:
+        float: The delay in seconds, or None when the error carries no such header.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None # Neither seconds nor an HTTP date
+    if retry_date is None:
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+def backoff_delay(attempt, error):
+    """
+    Jittered exponential backoff that never undercuts a server-provided Retry-After.
+    """
+    delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def call_with_rate_limit(function, api, model, messages, max_tokens, can_retry=None):
+    """
+    Calls function() within the backend's quota, retrying transient failures with backoff.
+    Quota waits and retries end with PipelineCancelled once the current pipeline run is cancelled or would
+    overrun its deadline (see cancellation).
+
+    Parameters:
+        function (callable): Performs the request and returns (result, prompt_tokens, completion_tokens).
+        api (str): The backend name.
+        model (str): The model name.
+        messages (list): The request messages, used to estimate token usage.
+        max_tokens (int): The completion token limit.
+        can_retry (callable): Optional check whether a failed request may still be retried. Streaming calls
+            pass one that returns False once a delta reached the caller, so a retry cannot repeat text.
+
+    Returns:
+        tuple: Whatever function() returns.
+    """
+    limiter = get_rate_limiter(api, model)
+    estimated_tokens = estimate_tokens(messages, max_tokens)
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire(estimated_tokens)
+        try:
+            response = function()
+        except Exception as error:
+            # A failed request used none of its reserved tokens
+            if limiter is not None:
+                limiter.record_usage(estimated_tokens, 0)
+            # A request timed out by the run's deadline is reported as such, not as a transient error
+            raise_if_cancelled()
+            if attempt == MAX_RETRIES or not is_retryable(error) or (can_retry is not None and not can_retry()):
+                raise
+            delay = backoff_delay(attempt, error)
+            if limiter is not None and getattr(error, "status_code", None) == 429:
+                limiter.pause(delay)
+            sleep(delay)
+            continue
+        if limiter is not None:
+            limiter.record_usage(estimated_tokens, response[1] + response[2])
+        return response
+
+async def acall_with_rate_limit(function, api, model, messages, max_tokens, can_retry=None):
+    """
+    Async variant of call_with_rate_limit; function() must return an awaitable.
+    """
+    limiter = get_rate_limiter(api, model)
+    estimated_tokens = estimate_tokens(messages, max_tokens)
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            await limiter.aacquire(estimated_tokens)
+        try:
+            response = await function()
+        except Exception as error:
+            if limiter is not None:
+                limiter.record_usage(estimated_tokens, 0)
+            raise_if_cancelled()
+            if attempt == MAX_RETRIES or not is_retryable(error) or (can_retry is not None and not can_retry()):
+                raise
+            delay = backoff_delay(attempt, error)
+            if limiter is not None and getattr(error, "status_code", None) == 429:
+                limiter.pause(delay)
+            await asleep(delay)
+            continue
+        if limiter is not None:
+            limiter.record_usage(estimated_tokens, response[1] + response[2])
+        return response
@@ -0,0 +1,178 @@
+#%%
+# PERSISTENT LLM RESPONSE CACHE (CONTENT-ADDRESSED, SQLITE)
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "./cache/llm_responses.sqlite"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # total size of cached responses before LRU eviction
+DEFAULT_TTL = 30 * 24 * 3600  # seconds a cached response stays valid
+
+def make_cache_key(messages, api, model, temperature, max_tokens, response_format=None):
+    """
+    Derives a content-addressed key for a completion request.
+
+    Parameters:
+        messages (list): The message payload sent to the model.
+        api (str): The backend, e.g. "openai", "ollama" or "vertexai".
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        max_tokens (int): The completion token limit.
+        response_format: The requested response format, if any.
+
+    Returns:
+        str: The SHA-256 hex digest identifying the request.
+    """
+    payload = json.dumps(
+        {
+            "messages": messages,
+            "api": api,
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "response_format": response_format,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    SQLite store of completion results with TTL expiry and size-based LRU eviction.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # no fsync per lookup; a crash may only drop recent entries
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Looks up a cached result.
+
+        Parameters:
+            key (str): The key returned by make_cache_key.
+
+        Returns:
+            str: The cached result, or None on a miss or an expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT result, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, result, prompt_tokens=0, completion_tokens=0):
+        """
+        Stores a result and evicts the least recently used entries beyond the size budget.
+
+        Parameters:
+            key (str): The key returned by make_cache_key.
+            result (str): The completion text.
+            prompt_tokens (int): Prompt tokens the original call consumed.
+            completion_tokens (int): Completion tokens the original call consumed.
+        """
+        now = time.time()
+        size = len(result.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, result, prompt_tokens, completion_tokens, size, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                evicted = []
+                for old_key, old_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    total -= old_size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters and the current number of entries and bytes stored.
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# The cache is opt-in: get_completion only consults it after enable_response_cache() is called
+_response_cache = None
+
+def enable_response_cache(path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+    """
+    Turns on response caching for every get_completion call in this process.
+
+    Returns:
+        ResponseCache: The active cache.
+    """
+    global _response_cache
+    disable_response_cache()
+    _response_cache = ResponseCache(path, max_bytes, ttl)
+    return _response_cache
+
+def disable_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = None
+
+def get_response_cache():
+    """
+    Returns:
+        ResponseCache: The active cache, or None when caching is disabled.
+    """
+    return _response_cache
@@ -2,10 +2,16 @@
 #%%
 # STEP 6 - SEQUENCE FLOWS IDENTIFICATION
 import json
-from llm_completion import get_completion
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from structured_output import StepOutput, structured_completion, astructured_completion
 
 # Constants for system and user messages
 delimiter = "####"
+# Fields of the process model this prompt uses; the pipeline sends only these with the description
+INPUT_FIELDS = ["Description", "ModelName", "Context", "Participants", "StartEvent", "EndEvent", "ActivitiesEvents", "ActionFlows", "Gateways", "Loops"]
+# Fields sent as names/ids only (see process_model.FIELD_SUMMARIES)
+SUMMARY_FIELDS = ["Participants", "ActivitiesEvents"]
 SYSTEM_MESSAGE_TEMPLATE = """
 You are an expert in business process modeling, specializing in Business Process Management (BPM) and Business Process Model and Notation (BPMN 2.0.2).
 
@@ -27,10 +33,7 @@ Instructions:
     - If no errors are found, produce the output.
 
 Negative Prompts:
-- No Additional Text: DO NOT include any additional text or metadata in the output, such as code comments, explanations, or formatting markers (e.g., ```json, ```, #, //).
-- No Non-JSON Data: DO NOT output any non-JSON data, such as headers, footers, or any descriptive text that is not part of the JSON structure.
 - No Empty or Null Values: DO NOT include empty or null values in the JSON output unless they are explicitly required by the context of the sequence flow.
-- No Inconsistent Formatting: DO NOT use inconsistent formatting in the JSON structure, such as unnecessary white spaces, line breaks, or indentation that does not adhere to standard JSON formatting practices.
 - No Incorrect Keys or Fields: DO NOT use incorrect or additional keys or fields in the JSON objects that are not specified in the task (e.g., avoid adding extra fields like "Notes" or "Description" unless explicitly instructed).
 
 BPMN-Specific Negative Prompts:
@@ -52,21 +55,10 @@ The employee onboarding process begins when a new hire submits their completed p
     {
         "ModelName": "Onboarding process",
         "Context": "Human Resources",
-        "Scope": "Starts with the submission of completed paperwork by the new hire and ends with the assignment of the new hire to their department.",
-        "Objectives": "To ensure new hires complete all necessary paperwork, attend orientation, and are successfully integrated into their departments.",
-        "Participants": [
-            {"HR_Department": "Responsible for reviewing documents, scheduling orientation, and assigning new hire to the department"},
-            {"New_Hire": "Responsible for submitting paperwork and attending orientation"}
-        ],
+        "Participants": ["HR_Department", "New_Hire"],
         "StartEvent": "Start_SubmitPaperwork",
         "EndEvent": "End_AssignDepartment",
-        "ActivitiesEvents": [
-            {"A_ReviewDocuments": "The HR department reviews the submitted documents"},
-            {"A_ReturnForCorrection": "If any documents are missing or incorrect, they are returned to the new hire for correction"},
-            {"A_ScheduleOrientation": "Once the documents are in order, the new hire is scheduled for orientation"},
-            {"E_AttendOrientation": "After attending the orientation"},
-            {"A_AssignToDepartment": "the new hire is assigned to their department"}
-        ],
+        "ActivitiesEvents": ["A_ReviewDocuments", "A_ReturnForCorrection", "A_ScheduleOrientation", "E_AttendOrientation", "A_AssignToDepartment"],
         "ActionFlows": [
             {"from": "Start_SubmitPaperwork", "to": "A_ReviewDocuments"},
             {"from": "A_ReviewDocuments", "to": "A_ReturnForCorrection"},
@@ -152,6 +144,17 @@ Output:
 """
 
 
+# Output schema, enforced where the backend supports structured outputs (see structured_output)
+class SequenceFlow(BaseModel):
+    from_node: str = Field(alias="from")
+    to_node: str = Field(alias="to")
+    condition: Optional[str] = Field(description="Condition of a flow leaving a split gateway, otherwise null")
+
+class SequenceFlowsOutput(StepOutput):
+    SequenceFlows: List[SequenceFlow]
+
+OUTPUT_SCHEMA = SequenceFlowsOutput
+
 def construct_user_message(text):
     """
     Constructs the user message by wrapping the text with delimiters.
@@ -180,26 +183,45 @@ def construct_messages(system_message, user_message):
         {'role': 'user', 'content': user_message}
     ]
 
-def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0):
+def build_messages(text):
     """
-    Identifies sequence flows in a business process description.
+    Builds the request messages for a description without calling the model, e.g. for batch submission.
     Parameters:
         text (str): The textual description of the business process.
     Returns:
-        dict: A dictionary containing identified sequence flows.
+        list: A list of message dictionaries.
     """
     system_message = SYSTEM_MESSAGE_TEMPLATE
     user_message = construct_user_message(text)
-    messages = construct_messages(system_message, user_message)
+    return construct_messages(system_message, user_message)
+
+def identify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Identifies sequence flows in a business process description.
+    Parameters:
+        text (str): The textual description of the business process.
+    Returns:
+        dict: A dictionary containing identified sequence flows.
+    """
+    messages = build_messages(text)
 
     #response = get_completion(messages, api="ollama", model="llama3.1", max_tokens=1000, temperature=0.0)
-    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature)
+    response, prompt_tokens, completion_tokens = structured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
     return response, prompt_tokens, completion_tokens
     # try:
     #     return json.loads(response)
     # except json.JSONDecodeError:
     #     return {"error": "Failed to decode JSON response"}
 
+async def aidentify_from_message(text, api="openai", model="gpt-4o-mini", temperature=0.0, on_chunk=None):
+    """
+    Async variant of identify_from_message, returns the same (response, prompt_tokens, completion_tokens) tuple.
+    """
+    messages = build_messages(text)
+
+    response, prompt_tokens, completion_tokens = await astructured_completion(messages, OUTPUT_SCHEMA, api, model, temperature, on_chunk=on_chunk)
+    return response, prompt_tokens, completion_tokens
+
 # Example usage
 if __name__ == "__main__":
     text_description = """
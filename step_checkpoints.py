@@ -0,0 +1,129 @@
+#%%
+# PER-STEP CHECKPOINTS (SQLITE)
+# Every successfully parsed step result is stored under a key derived from the step's input text, its prompt
+# template and its model settings. A rerun over the same description restores the finished steps and resumes
+# at the first step that is missing or failed before.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from model_cascade import step_tiers
+
+DEFAULT_CHECKPOINT_PATH = "./cache/step_checkpoints.sqlite"
+
+def make_step_key(step, step_input):
+    """
+    Derives the checkpoint key of a step run.
+
+    Parameters:
+        step (PipelineStep): The pipeline step.
+        step_input (str): The step's input text (description plus upstream JSON).
+
+    Returns:
+        str: The SHA-256 hex digest identifying the step run.
+    """
+    payload = json.dumps(
+        {
+            "step": step.name,
+            # The built messages contain both the prompt template and the input text
+            "messages": step.module.build_messages(step_input),
+            "api": step.api,
+            "model": step.model,
+            "temperature": step.temperature,
+            "output_format": step.output_format,
+            "tiers": step_tiers(step),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class CheckpointStore:
+    """
+    SQLite store of step results. Safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH):
+        self.path = path
+        self.restored = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS checkpoints (
+                key TEXT PRIMARY KEY,
+                step TEXT NOT NULL,
+                result TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                created REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Parameters:
+            key (str): The key returned by make_step_key.
+
+        Returns:
+            tuple: (result, prompt_tokens, completion_tokens) of the stored step run, or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT result, prompt_tokens, completion_tokens FROM checkpoints WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.restored += 1
+        return row
+
+    def set(self, key, step_name, result, prompt_tokens=0, completion_tokens=0):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                (key, step_name, result, prompt_tokens, completion_tokens, time.time()),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints")
+            self._conn.commit()
+            self.restored = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Checkpointing is opt-in: the step executors only consult the store after enable_step_checkpoints() is called
+_checkpoint_store = None
+
+def enable_step_checkpoints(path=DEFAULT_CHECKPOINT_PATH):
+    """
+    Turns on step checkpointing for every pipeline run in this process.
+
+    Returns:
+        CheckpointStore: The active store.
+    """
+    global _checkpoint_store
+    disable_step_checkpoints()
+    _checkpoint_store = CheckpointStore(path)
+    return _checkpoint_store
+
+def disable_step_checkpoints():
+    global _checkpoint_store
+    if _checkpoint_store is not None:
+        _checkpoint_store.close()
+    _checkpoint_store = None
+
+def get_checkpoint_store():
+    """
+    Returns:
+        CheckpointStore: The active store, or None when checkpointing is disabled.
+    """
+    return _checkpoint_store
@@ -0,0 +1,115 @@
+#%%
+# STEP-NECESSITY GATING
+# Cheap local checks deciding per document whether an LLM step can change the model at all. A gate returns the
+# reason for skipping the step, or None when the step has to run.
+import os
+import re
+
+GATEWAYS_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_template", "gateways_Prompt.txt")
+
+# "and" is listed as a parallel gateway clue but joins words in nearly every sentence; parallel branches still
+# show up as splits in the ActionFlows
+GENERIC_CUES = {"and"}
+
+LOOP_CUES = [
+    "repeat", "again", "until", "loop", "back to", "revisit", "retry", "redo", "rework", "resubmit",
+    "cycle", "iterate", "iteration", "as long as", "while not", "once more",
+]
+
+# Section headers of the structured description produced by input_preprocess (SYSTEM_MESSAGE_TEMPLATE_NEW_8_12_2024)
+PREPROCESSED_HEADERS = ["Process Name:", "Objective:", "Steps:", "Decisions Points:"]
+
+_gating_enabled = True
+
+def enable_step_gating():
+    global _gating_enabled
+    _gating_enabled = True
+
+def disable_step_gating():
+    """
+    Runs every step again, e.g. to audit the quality of skipped steps.
+    """
+    global _gating_enabled
+    _gating_enabled = False
+
+def is_step_gating_enabled():
+    return _gating_enabled
+
+def load_gateway_cues(path=GATEWAYS_PROMPT_PATH):
+    """
+    Reads the textual clues of all gateway types from the gateways prompt template.
+
+    Returns:
+        list: The quoted clue phrases, e.g. "if", "either", "at the same time".
+    """
+    with open(path, encoding="utf-8") as file:
+        template = file.read()
+    cues = []
+    for line in re.findall(r"\*\*Textual Clues\*\*:(.*)", template):
+        for cue in re.findall(r'"([^"]+)"', line):
+            if cue.lower() not in GENERIC_CUES and cue.lower() not in cues:
+                cues.append(cue.lower())
+    return cues
+
+GATEWAY_CUES = load_gateway_cues()
+
+def find_cues(text, cues):
+    """
+    Returns:
+        list: The cues occurring in the text as whole words or phrases (case-insensitive).
+    """
+    text = text.lower()
+    return [cue for cue in cues if re.search(r"\b" + re.escape(cue) + r"\b", text)]
+
+def _flow_graph(action_flows):
+    successors = {}
+    predecessors = {}
+    for flow in action_flows or []:
+        if not isinstance(flow, dict) or "from" not in flow or "to" not in flow:
+            continue
+        successors.setdefault(flow["from"], set()).add(flow["to"])
+        predecessors.setdefault(flow["to"], set()).add(flow["from"])
+    return successors, predecessors
+
+def is_linear(action_flows):
+    """
+    Returns:
+        bool: True when no node of the ActionFlows has more than one successor or predecessor.
+    """
+    successors, predecessors = _flow_graph(action_flows)
+    return all(len(nodes) <= 1 for nodes in successors.values()) and all(len(nodes) <= 1 for nodes in predecessors.values())
+
+def has_cycle(action_flows):
+    successors, _ = _flow_graph(action_flows)
+    visiting = set()
+    visited = set()
+
+    def visit(node):
+        visiting.add(node)
+        for successor in successors.get(node, ()):
+            if successor in visiting or (successor not in visited and visit(successor)):
+                return True
+        visiting.discard(node)
+        visited.add(node)
+        return False
+
+    return any(node not in visited and visit(node) for node in list(successors))
+
+def preprocess_gate(model):
+    if all(header in model.description for header in PREPROCESSED_HEADERS):
+        return "description is already structured"
+    return None
+
+def gateways_gate(model):
+    if model.action_flows is None or not is_linear(model.action_flows):
+        return None
+    if find_cues(model.description, GATEWAY_CUES):
+        return None
+    return "linear ActionFlows and no decision or parallelism cues"
+
+def loops_gate(model):
+    if model.action_flows is None or has_cycle(model.action_flows):
+        return None
+    if find_cues(model.description, LOOP_CUES):
+        return None
+    return "acyclic ActionFlows and no repetition cues"
@@ -0,0 +1,385 @@
+#%%
+# PIPELINE STEP EXECUTOR
+# Every pipeline step declares which fields of the accumulated process model it reads and writes. The steps run in
+# declaration order; each one receives only the upstream fields it reads, and gated, unchanged or checkpointed
+# steps are recorded without a call. Finished steps update one ProcessModel in place.
+import json
+import time
+from process_model import ProcessModel
+from step_checkpoints import get_checkpoint_store, make_step_key
+from step_gating import is_step_gating_enabled
+from model_cascade import step_tiers, make_attempt
+from json_recovery import recover_json
+from cancellation import cancellation_scope, current_token, raise_if_cancelled
+
+# Fields of the accumulated process model
+DESCRIPTION = "Description"
+CONTEXT_FIELDS = ["ModelName", "Context", "Scope", "Objectives", "Participants"]
+ACTIVITY_FIELDS = ["StartEvent", "EndEvent", "ActivitiesEvents"]
+ACTION_FLOW_FIELDS = ["ActionFlows"]
+GATEWAY_FIELDS = ["Gateways"]
+LOOP_FIELDS = ["Loops"]
+SEQUENCE_FLOW_FIELDS = ["SequenceFlows"]
+
+class StepFailed(ValueError):
+    """
+    Raised when the last tier of a step returns no usable output. Its record holds the attempts of every tier
+    called, so their tokens still count towards the run's usage and cost.
+    """
+
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+        self.record = None # Set by the step executor
+
+class PipelineStep:
+    """
+    One LLM step of the pipeline.
+
+    Parameters:
+        name (str): Short step name, e.g. "gateways".
+        title (str): Progress message printed for the step.
+        module: The step module providing identify_from_message, aidentify_from_message and build_messages.
+        reads (list): Model fields the step needs as input, by default the module's INPUT_FIELDS.
+        summary_fields (list): Fields the step reads in their short form (see process_model.FIELD_SUMMARIES), by
+            default the module's SUMMARY_FIELDS.
+        writes (list): Model fields the step produces.
+        api (str): The backend used for the step.
+        model (str): The model used for the step.
+        temperature (float): The sampling temperature.
+        output_format (str): "json" for a JSON object merged into the model, "text" for a plain text field.
+        gate (callable): Optional check gate(model) returning the reason the step cannot change the model
+            (see step_gating), or None when it has to run.
+        cascade (list): The (api, model) tiers tried in order while the model cascade is enabled, cheapest first;
+            the last one is accepted as it is (see model_cascade). The step's own api and model are used alone
+            when the cascade is disabled.
+        check (callable): Local check check(output, model) returning the problems of a step output (see
+            model_validation); a cascade tier whose output has problems escalates to the next tier.
+    """
+
+    def __init__(self, name, title, module, writes, reads=None, summary_fields=None, api="openai", model="gpt-4o-mini", temperature=0.7, output_format="json", gate=None, cascade=None, check=None):
+        self.name = name
+        self.title = title
+        self.module = module
+        self.reads = list(module.INPUT_FIELDS if reads is None else reads)
+        self.summary_fields = list(getattr(module, "SUMMARY_FIELDS", []) if summary_fields is None else summary_fields)
+        self.writes = list(writes)
+        self.api = api
+        self.model = model
+        self.temperature = temperature
+        self.output_format = output_format
+        self.gate = gate
+        self.cascade = list(cascade or [])
+        self.check = check
+
+    def identify(self, text, on_chunk=None, api=None, model=None):
+        return self.module.identify_from_message(text, api=api or self.api, model=model or self.model, temperature=self.temperature, on_chunk=on_chunk)
+
+    async def aidentify(self, text, on_chunk=None, api=None, model=None):
+        return await self.module.aidentify_from_message(text, api=api or self.api, model=model or self.model, temperature=self.temperature, on_chunk=on_chunk)
+
+def step_dependencies(steps):
+    """
+    Resolves the direct dependencies of every step: the earlier steps writing a field it reads.
+
+    Returns:
+        dict: Step name -> set of step names it waits for.
+    """
+    dependencies = {}
+    for index, step in enumerate(steps):
+        dependencies[step.name] = {
+            earlier.name for earlier in steps[:index] if set(earlier.writes) & set(step.reads)
+        }
+    return dependencies
+
+def step_ancestors(steps):
+    """
+    Returns:
+        dict: Step name -> set of all step names it depends on directly or transitively.
+    """
+    dependencies = step_dependencies(steps)
+    ancestors = {}
+    for step in steps:
+        names = set()
+        for dependency in dependencies[step.name]:
+            names.add(dependency)
+            names |= ancestors[dependency]
+        ancestors[step.name] = names
+    return ancestors
+
+def parse_json_result(result):
+    """
+    Parses a step's JSON output into one object; a list is reduced to its first object, an empty list to {}.
+    Fences, commentary and common defects are recovered locally (see json_recovery).
+
+    Raises:
+        ValueError: If no valid JSON can be recovered from the result, e.g. because it is truncated.
+    """
+    try:
+        json_data = recover_json(result)
+    except ValueError as e:
+        print("Error: current_result is not a valid JSON.")
+        print("current_result:", result)
+        raise ValueError(f"Error: current_result is not a valid JSON. {e}")
+    if isinstance(json_data, list):
+        json_data = json_data[0] if json_data else {}
+    return json_data
+
+def upstream_fields(steps, ancestors):
+    """
+    Returns:
+        dict: Step name -> the fields it reads that the steps it depends on write, i.e. the JSON projection sent
+        with its prompt.
+    """
+    writes = {step.name: step.writes for step in steps}
+    return {
+        step.name: {field for name in ancestors[step.name] for field in writes[name] if field != DESCRIPTION and field in step.reads}
+        for step in steps
+    }
+
+def apply_record(model, step, record):
+    """
+    Updates the process model in place with a finished step's output.
+    """
+    if step.output_format == "text":
+        model.description = record["output"] # The preprocessing replaces the original description
+    else:
+        model.update(record["output"])
+
+def build_step_input(step, model, fields):
+    """
+    Builds a step's input text: the description followed by the compact JSON of the upstream fields it reads,
+    with its summary fields in their short form.
+    """
+    return model.to_prompt(fields[step.name], step.summary_fields)
+
+def check_step_output(step, model, result):
+    """
+    Returns:
+        list: The problems of a step result: invalid JSON or the findings of the step's local check.
+    """
+    try:
+        output = result if step.output_format == "text" else parse_json_result(result)
+    except ValueError:
+        return ["invalid JSON"]
+    return step.check(output, model)
+
+def _cascade_response(attempts, result):
+    # The record counts the tokens of every tier called
+    return (
+        result,
+        sum(attempt["prompt_tokens"] for attempt in attempts),
+        sum(attempt["completion_tokens"] for attempt in attempts),
+    )
+
+def identify_step(step, step_input, model, on_chunk=None):
+    """
+    Runs a step through its tiers (see model_cascade.step_tiers). Each tier's output is checked locally and the
+    next tier is only called when the check fails; the output of the last tier is accepted as it is.
+
+    Returns:
+        tuple: The (result, prompt_tokens, completion_tokens) response, with the tokens of all tiers called,
+        and the list of attempts.
+
+    Raises:
+        StepFailed: If the last tier returns no valid output.
+    """
+    tiers = step_tiers(step)
+    attempts = []
+    for index, (api, model_name) in enumerate(tiers):
+        try:
+            result, prompt_tokens, completion_tokens = step.identify(step_input, on_chunk, api, model_name)
+        except ValueError as e:
+            # A response not matching the output schema (see structured_output) escalates like a failed check
+            attempts.append(make_attempt(api, model_name, getattr(e, "prompt_tokens", 0), getattr(e, "completion_tokens", 0), [str(e)]))
+            if index == len(tiers) - 1:
+                raise StepFailed(str(e), attempts) from e
+            continue
+        problems = check_step_output(step, model, result) if index < len(tiers) - 1 else []
+        attempts.append(make_attempt(api, model_name, prompt_tokens, completion_tokens, problems))
+        if not problems:
+            break
+    return _cascade_response(attempts, result), attempts
+
+async def aidentify_step(step, step_input, model, on_chunk=None):
+    """
+    Async variant of identify_step.
+    """
+    tiers = step_tiers(step)
+    attempts = []
+    for index, (api, model_name) in enumerate(tiers):
+        try:
+            result, prompt_tokens, completion_tokens = await step.aidentify(step_input, on_chunk, api, model_name)
+        except ValueError as e:
+            # A response not matching the output schema (see structured_output) escalates like a failed check
+            attempts.append(make_attempt(api, model_name, getattr(e, "prompt_tokens", 0), getattr(e, "completion_tokens", 0), [str(e)]))
+            if index == len(tiers) - 1:
+                raise StepFailed(str(e), attempts) from e
+            continue
+        problems = check_step_output(step, model, result) if index < len(tiers) - 1 else []
+        attempts.append(make_attempt(api, model_name, prompt_tokens, completion_tokens, problems))
+        if not problems:
+            break
+    return _cascade_response(attempts, result), attempts
+
+def _record(step, step_input, response, start_time, restored=False, skipped=None, attempts=None):
+    result, prompt_tokens, completion_tokens = response
+    return {
+        "input": step_input,
+        "result": result,
+        "output": result if step.output_format == "text" else parse_json_result(result),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "duration": time.time() - start_time,
+        "restored": restored,
+        "skipped": skipped,
+        "attempts": attempts or [],
+    }
+
+def failed_record(step, step_input, error, start_time):
+    """
+    Returns:
+        dict: The record of a failed step: no result or output, but the tokens and attempts of the tiers called.
+    """
+    attempts = error.attempts
+    return {
+        "input": step_input,
+        "result": None,
+        "output": None,
+        "prompt_tokens": sum(attempt["prompt_tokens"] for attempt in attempts),
+        "completion_tokens": sum(attempt["completion_tokens"] for attempt in attempts),
+        "duration": time.time() - start_time,
+        "restored": False,
+        "skipped": None,
+        "attempts": attempts,
+        "error": str(error),
+    }
+
+def skip_step(step, model, step_input):
+    """
+    Returns a record with the step's empty output when its gate says the step cannot change the model, else None.
+    The skip reason is kept in the record's "skipped" entry for auditing.
+    """
+    if step.gate is None or not is_step_gating_enabled():
+        return None
+    reason = step.gate(model)
+    if reason is None:
+        return None
+    if step.output_format == "text":
+        result = model.description
+    else:
+        result = json.dumps([{field: [] for field in step.writes}])
+    return _record(step, step_input, (result, 0, 0), time.time(), skipped=reason)
+
+def restore_step(step, step_input):
+    """
+    Returns the checkpointed record of a step run, or None when checkpointing is disabled or the run is new.
+    Restored steps cost no tokens in this run.
+    """
+    store = get_checkpoint_store()
+    if store is None:
+        return None
+    checkpoint = store.get(make_step_key(step, step_input))
+    if checkpoint is None:
+        return None
+    return _record(step, step_input, (checkpoint[0], 0, 0), time.time(), restored=True)
+
+def reuse_step(step, step_input, previous_records):
+    """
+    Returns the previous run's record of a step when the step's input is unchanged, otherwise None.
+    The comparison uses the same hash as the checkpoints (input text, prompt template and model settings).
+    """
+    if not previous_records or step.name not in previous_records:
+        return None
+    previous = previous_records[step.name]
+    if previous["result"] is None:
+        return None # The step failed
+    if make_step_key(step, previous["input"]) != make_step_key(step, step_input):
+        return None
+    return dict(previous, prompt_tokens=0, completion_tokens=0, duration=0.0, restored=True, attempts=[])
+
+def save_step(step, record):
+    store = get_checkpoint_store()
+    if store is not None and not record["restored"]:
+        store.set(make_step_key(step, record["input"]), step.name, record["result"], record["prompt_tokens"], record["completion_tokens"])
+
+def _recorded_step(step, model, step_input, previous_records):
+    # The record of a step that needs no call: gated, unchanged since the previous run or checkpointed
+    return skip_step(step, model, step_input) or reuse_step(step, step_input, previous_records) or restore_step(step, step_input)
+
+def _finish_step(step, model, records, record, on_step_done):
+    records[step.name] = record
+    apply_record(model, step, record)
+    if on_step_done is not None:
+        on_step_done(step, record)
+
+def run_step_graph(steps, process_description, on_chunk=None, on_step_done=None, previous_records=None, cancel_token=None):
+    """
+    Runs the steps one after another in declaration order, which puts every step after the steps it reads from.
+    When a step fails or the run is cancelled, no further steps are started. LLM calls time out with the run's
+    deadline.
+
+    Parameters:
+        steps (list): The pipeline steps in declaration order.
+        process_description (str): The textual description of the business process.
+        on_chunk (callable): Optional callback receiving streamed text deltas.
+        on_step_done (callable): Optional callback on_step_done(step, record) invoked as each step finishes.
+        previous_records (dict): Records of an earlier run, e.g. over a previous version of the description.
+            Steps whose input is unchanged reuse their record, so only changed steps and the dependents whose
+            input changes in turn are re-run.
+        cancel_token (CancellationToken): Optional deadline and cancellation flag of the run (see cancellation).
+            Defaults to the token of the enclosing run, if any.
+
+    Returns:
+        tuple: The process model (ProcessModel) and a dict of step name -> record with input, result, output,
+        prompt_tokens, completion_tokens, duration, restored, skipped and attempts (the cascade tiers called).
+
+    Raises:
+        StepFailed: If a step returns no valid output; its record keeps the tokens of the failed attempts.
+        PipelineCancelled: If the run is cancelled or exceeds its deadline (DeadlineExceeded).
+    """
+    cancel_token = cancel_token or current_token()
+    fields = upstream_fields(steps, step_ancestors(steps))
+    model = ProcessModel(process_description)
+    records = {}
+    with cancellation_scope(cancel_token):
+        for step in steps:
+            raise_if_cancelled()
+            step_input = build_step_input(step, model, fields)
+            record = _recorded_step(step, model, step_input, previous_records)
+            if record is None:
+                start_time = time.time()
+                try:
+                    response, attempts = identify_step(step, step_input, model, on_chunk)
+                except StepFailed as e:
+                    e.record = failed_record(step, step_input, e, start_time)
+                    raise
+                record = _record(step, step_input, response, start_time, attempts=attempts)
+                save_step(step, record)
+            _finish_step(step, model, records, record, on_step_done)
+    return model, records
+
+async def arun_step_graph(steps, process_description, on_chunk=None, on_step_done=None, previous_records=None, cancel_token=None):
+    """
+    Async variant of run_step_graph: the steps' LLM calls do not block the event loop.
+    """
+    cancel_token = cancel_token or current_token()
+    fields = upstream_fields(steps, step_ancestors(steps))
+    model = ProcessModel(process_description)
+    records = {}
+    with cancellation_scope(cancel_token):
+        for step in steps:
+            raise_if_cancelled()
+            step_input = build_step_input(step, model, fields)
+            record = _recorded_step(step, model, step_input, previous_records)
+            if record is None:
+                start_time = time.time()
+                try:
+                    response, attempts = await aidentify_step(step, step_input, model, on_chunk)
+                except StepFailed as e:
+                    e.record = failed_record(step, step_input, e, start_time)
+                    raise
+                record = _record(step, step_input, response, start_time, attempts=attempts)
+                save_step(step, record)
+            _finish_step(step, model, records, record, on_step_done)
+    return model, records
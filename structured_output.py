@@ -0,0 +1,183 @@
+#%%
+# SCHEMA-ENFORCED STRUCTURED OUTPUTS
+# Step modules declare a pydantic model of their output (OUTPUT_SCHEMA). Backends enforcing JSON schemas receive it
+# as a strict response_format and the response is parsed straight into the typed object, which is then converted
+# to the step's usual result ([{...}] JSON, as in the prompt examples). Other backends get the prompt with an
+# instruction to answer with JSON only (JSON_ONLY_INSTRUCTION).
+# Either way the response goes through the local JSON recovery (json_recovery); a truncated response is completed
+# with a continuation request instead of re-running the step.
+import json
+from pydantic import BaseModel, ValidationError
+from llm_completion import get_completion, aget_completion, supports_json_schema
+from json_recovery import TruncatedJSONError, recover_json_text, continuation_messages, join_continuation
+
+# Continuation requests per step call before a truncated response counts as failed
+MAX_CONTINUATIONS = 2
+# Added to the system message where no schema constrains the output
+JSON_ONLY_INSTRUCTION = "Ensure the output is strictly in JSON format without any additional text."
+
+class InvalidOutputError(ValueError):
+    """
+    Raised when no valid step output can be recovered from a response. Carries the tokens the requests used, so a
+    failed call still counts towards usage and cost.
+    """
+
+    def __init__(self, message, prompt_tokens=0, completion_tokens=0):
+        super().__init__(message)
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+class StepOutput(BaseModel):
+    """
+    Base class of the step output schemas.
+    """
+
+    def to_output(self):
+        """
+        Returns:
+            dict: The output in the format of the step's prompt examples, which later steps and the outputs use.
+        """
+        return self.model_dump(by_alias=True, exclude_none=True)
+
+def strict_json_schema(schema):
+    """
+    Converts a pydantic JSON schema to the strict subset of structured outputs: every object closes its
+    properties and lists all of them as required; defaults are not supported.
+    """
+    if isinstance(schema, dict):
+        schema = {key: strict_json_schema(value) for key, value in schema.items() if key != "default"}
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["additionalProperties"] = False
+            schema["required"] = list(schema["properties"])
+    elif isinstance(schema, list):
+        schema = [strict_json_schema(value) for value in schema]
+    return schema
+
+def response_format_for(output_schema):
+    """
+    Returns:
+        dict: The json_schema response format of a step output schema.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": output_schema.__name__,
+            "strict": True,
+            "schema": strict_json_schema(output_schema.model_json_schema()),
+        },
+    }
+
+def structured_result(response, output_schema, prompt_tokens, completion_tokens):
+    # parse_structured_result that reports the tokens of the response with its error
+    try:
+        return parse_structured_result(response, output_schema), prompt_tokens, completion_tokens
+    except ValueError as e:
+        raise InvalidOutputError(str(e), prompt_tokens, completion_tokens) from e
+
+def json_only_messages(messages):
+    """
+    Returns:
+        list: The messages with JSON_ONLY_INSTRUCTION appended to the system message, for backends that cannot
+        enforce the output schema.
+    """
+    return [
+        dict(message, content=message["content"].rstrip() + "\n" + JSON_ONLY_INSTRUCTION) if message["role"] == "system" else message
+        for message in messages
+    ]
+
+def parse_structured_result(result, output_schema):
+    """
+    Parses a schema-constrained response into the typed output and converts it to the step's result format.
+
+    Raises:
+        ValueError: If the response is empty (e.g. a refusal) or does not match the schema.
+    """
+    if not result:
+        raise ValueError(f"Error: no {output_schema.__name__} in the response.")
+    try:
+        output = output_schema.model_validate_json(result)
+    except ValidationError as e:
+        raise ValueError(f"Error: the response does not match {output_schema.__name__}: {e}")
+    return json.dumps([output.to_output()], indent=4)
+
+def recovered_response(response, prompt_tokens, completion_tokens):
+    """
+    Returns:
+        tuple: The recovered JSON result text (see json_recovery.recover_json_text), prompt tokens and completion tokens.
+
+    Raises:
+        InvalidOutputError: If no valid JSON can be recovered, with the tokens of the response.
+    """
+    try:
+        return recover_json_text(response), prompt_tokens, completion_tokens
+    except ValueError as e:
+        raise InvalidOutputError(str(e), prompt_tokens, completion_tokens) from e
+
+def json_completion(messages, api, model, temperature, max_tokens=1000, on_chunk=None, response_format=None):
+    """
+    Calls get_completion and recovers the JSON of the response. A truncated response is continued with up to
+    MAX_CONTINUATIONS follow-up requests that only ask for the missing rest.
+
+    Returns:
+        tuple: The JSON result text, prompt tokens and completion tokens (of all requests).
+
+    Raises:
+        InvalidOutputError: If no valid JSON can be recovered.
+    """
+    response, prompt_tokens, completion_tokens = get_completion(messages, api, model, temperature, max_tokens, on_chunk=on_chunk, response_format=response_format)
+    for _ in range(MAX_CONTINUATIONS):
+        try:
+            return recovered_response(response, prompt_tokens, completion_tokens)
+        except InvalidOutputError as e:
+            if not isinstance(e.__cause__, TruncatedJSONError):
+                raise
+            print(f"Truncated JSON from {api}:{model}, requesting the continuation")
+        # The continuation is plain text: a schema would force a new, complete JSON value
+        continuation, more_prompt_tokens, more_completion_tokens = get_completion(continuation_messages(messages, response), api, model, temperature, max_tokens, on_chunk=on_chunk)
+        response = join_continuation(response, continuation)
+        prompt_tokens += more_prompt_tokens
+        completion_tokens += more_completion_tokens
+    return recovered_response(response, prompt_tokens, completion_tokens)
+
+async def ajson_completion(messages, api, model, temperature, max_tokens=1000, on_chunk=None, response_format=None):
+    """
+    Async variant of json_completion.
+    """
+    response, prompt_tokens, completion_tokens = await aget_completion(messages, api, model, temperature, max_tokens, on_chunk=on_chunk, response_format=response_format)
+    for _ in range(MAX_CONTINUATIONS):
+        try:
+            return recovered_response(response, prompt_tokens, completion_tokens)
+        except InvalidOutputError as e:
+            if not isinstance(e.__cause__, TruncatedJSONError):
+                raise
+            print(f"Truncated JSON from {api}:{model}, requesting the continuation")
+        continuation, more_prompt_tokens, more_completion_tokens = await aget_completion(continuation_messages(messages, response), api, model, temperature, max_tokens, on_chunk=on_chunk)
+        response = join_continuation(response, continuation)
+        prompt_tokens += more_prompt_tokens
+        completion_tokens += more_completion_tokens
+    return recovered_response(response, prompt_tokens, completion_tokens)
+
+def structured_completion(messages, output_schema, api, model, temperature, max_tokens=1000, on_chunk=None, fallback_format=None):
+    """
+    Calls json_completion with the output schema enforced where the backend supports it.
+
+    Parameters:
+        output_schema: The StepOutput subclass of the step.
+        fallback_format (dict): Response format for backends without JSON schema support, e.g. {"type": "json_object"}.
+
+    Returns:
+        tuple: The result in the step's result format, prompt tokens and completion tokens.
+    """
+    if not supports_json_schema(api):
+        return json_completion(json_only_messages(messages), api, model, temperature, max_tokens, on_chunk=on_chunk, response_format=fallback_format)
+    response, prompt_tokens, completion_tokens = json_completion(messages, api, model, temperature, max_tokens, on_chunk=on_chunk, response_format=response_format_for(output_schema))
+    return structured_result(response, output_schema, prompt_tokens, completion_tokens)
+
+async def astructured_completion(messages, output_schema, api, model, temperature, max_tokens=1000, on_chunk=None, fallback_format=None):
+    """
+    Async variant of structured_completion.
+    """
+    if not supports_json_schema(api):
+        return await ajson_completion(json_only_messages(messages), api, model, temperature, max_tokens, on_chunk=on_chunk, response_format=fallback_format)
+    response, prompt_tokens, completion_tokens = await ajson_completion(messages, api, model, temperature, max_tokens, on_chunk=on_chunk, response_format=response_format_for(output_schema))
+    return structured_result(response, output_schema, prompt_tokens, completion_tokens)
@@ -0,0 +1,86 @@
+#%%
+# VERTEX AI CREDENTIALS (ONE-TIME SDK INIT AND CACHED ACCESS TOKEN)
+import asyncio
+import datetime
+import os
+import threading
+from google.auth import default, transport
+
+# Vertex AI project settings
+SERVICE_ACCOUNT_PATH = r"D:\keys\focal-healer-431902-q6-19dcf02385ff.json"
+PROJECT_ID = "focal-healer-431902-q6"
+LOCATION = "us-central1"
+BUCKET_NAME = "mybucket"
+BUCKET_URI = f"gs://{BUCKET_NAME}"
+
+# OpenAI-compatible Chat Completions endpoint for Llama 3.1 on Vertex AI
+MODEL_LOCATION = "us-central1"
+VERTEX_OPENAI_BASE_URL = f"https://{MODEL_LOCATION}-aiplatform.googleapis.com/v1beta1/projects/{PROJECT_ID}/locations/{MODEL_LOCATION}/endpoints/openapi/chat/completions?"
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+TOKEN_REFRESH_MARGIN = 300  # seconds before expiry at which the token is refreshed
+
+class VertexAICredentials:
+    """
+    Initializes the Vertex AI SDK once per process and caches the access token until shortly
+    before it expires. Concurrent callers that find the token stale share a single refresh.
+    """
+
+    def __init__(self, scopes=SCOPES, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.scopes = scopes
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def _init_sdk(self):
+        # Set environment variable for Google Application Credentials
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = SERVICE_ACCOUNT_PATH
+
+        # Initialize Vertex AI SDK for Python
+        import vertexai
+        vertexai.init(project=PROJECT_ID, location=LOCATION, staging_bucket=BUCKET_URI)
+
+        credentials, project = default(scopes=self.scopes)
+        return credentials
+
+    def _is_fresh(self):
+        credentials = self._credentials
+        if credentials is None or not credentials.token:
+            return False
+        if credentials.expiry is None:
+            return True
+        # google-auth reports expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return credentials.expiry - now > self.refresh_margin
+
+    def get_token(self):
+        """
+        Returns a valid access token, refreshing it only when it is about to expire.
+
+        Returns:
+            str: The OAuth2 access token.
+        """
+        if self._is_fresh():
+            return self._credentials.token
+
+        with self._lock:
+            # Another caller may have refreshed while we were waiting for the lock
+            if not self._is_fresh():
+                if self._credentials is None:
+                    self._credentials = self._init_sdk()
+                self._credentials.refresh(transport.requests.Request())
+            return self._credentials.token
+
+    async def aget_token(self):
+        """
+        Async variant of get_token; only a needed refresh is moved off the event loop.
+
+        Returns:
+            str: The OAuth2 access token.
+        """
+        if self._is_fresh():
+            return self._credentials.token
+        return await asyncio.to_thread(self.get_token)
+
+# Process-wide credential manager
+vertex_credentials = VertexAICredentials()